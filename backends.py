@@ -0,0 +1,359 @@
+"""
+Execution backends: where the Sparkify SQL runs.
+
+`create_tables`, `load_staging_tables` and `insert_tables` only need a DB-API style `cur`/`conn`
+pair (`cur.execute(sql)`, `conn.commit()`). A backend hands out that pair:
+
+- `RedshiftBackend`: psycopg2 connection to the cluster in `dwh_035_access.cfg` (the default).
+- `DuckDBBackend`: an in-process DuckDB database that runs the same Redshift SQL on local files, so the
+  whole pipeline can run in seconds on a laptop for benchmarking and tests (`pip install duckdb`).
+
+The DuckDB cursor translates the Redshift-specific bits of every statement before running it:
+
+- `IDENTITY(0,1)` columns become `DEFAULT nextval(...)` of a sequence starting at 0.
+- `PRIMARY KEY` is dropped: Redshift does not enforce it, DuckDB would.
+- A bare `DECIMAL` becomes `DECIMAL(18,0)`, Redshift's default precision and scale.
+- `COPY ... FROM 's3://...'` becomes an `INSERT ... SELECT` from DuckDB's native JSON reader on the
+  matching local files: `s3://<bucket>/<key>` is read from `<data_dir>/<key>`, a directory meaning every
+  `*.json` below it. `FORMAT AS JSON 'auto'` matches columns by name, a jsonpaths file maps them by
+  position, `MANIFEST` reads the file list from the (local) manifest, `TIMEFORMAT AS 'epochmillisecs'`
+  converts with `epoch_ms`, and `EMPTYASNULL`/`BLANKSASNULL` turn empty/blank strings into NULL. Values
+  are converted with a plain `CAST`, so one that does not fit its column fails the COPY, as on Redshift.
+- `UNLOAD (...) TO 's3://...' FORMAT AS PARQUET` becomes `COPY (...) TO '<data_dir>/...' (FORMAT PARQUET)`.
+- Spectrum (`tiering.py`): an external schema becomes a plain schema, and a partitioned Parquet external
+  table becomes a view over `read_parquet(..., hive_partitioning = true)` on its local folder (an empty
+  view until the first partition is added). `svv_tables` reads `information_schema.tables`, and
+  `WITH NO SCHEMA BINDING` views drop the clause and read `public.` as DuckDB's `main.`.
+
+To mirror the Udacity bucket locally:
+
+    aws s3 sync s3://udacity-dend/log_data data/log_data
+    aws s3 sync s3://udacity-dend/song_data data/song_data
+    aws s3 cp s3://udacity-dend/log_json_path.json data/log_json_path.json
+"""
+
+import glob
+import json
+import os
+import re
+
+from dwh_config import ACCESS_CFG
+
+
+class RedshiftBackend:
+    """Run on the Redshift cluster described by `dwh_035_access.cfg`."""
+
+    name = "redshift"
+
+    def __init__(self, access_path=ACCESS_CFG):
+        self.access_path = access_path
+
+    def connect(self):
+        from dwh_config import connect
+
+        return connect(self.access_path)
+
+
+class DuckDBBackend:
+    """Run on a local DuckDB database, reading the `s3://` sources from `data_dir`."""
+
+    name = "duckdb"
+
+    def __init__(self, database=":memory:", data_dir="data"):
+        self.database = database
+        self.data_dir = data_dir
+
+    def connect(self):
+        import duckdb
+
+        return DuckDBConnection(duckdb.connect(self.database), self.data_dir)
+
+
+BACKENDS = {
+    "redshift": RedshiftBackend,
+    "duckdb": DuckDBBackend,
+}
+
+
+def get_backend(name="redshift", **options):
+    """Create the backend called `name` (see `BACKENDS`), passing it `options`."""
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return backend(**options)
+
+
+# DUCKDB
+
+class DuckDBConnection:
+    """
+    DB-API style wrapper around a DuckDB connection.
+
+    As with psycopg2, a cursor's first statement opens a transaction (`BEGIN`) that lasts until `commit` or
+    `rollback`, unless `autocommit` is set. Each cursor runs on its own DuckDB cursor, which has its own
+    transaction, so `commit` and `rollback` end the transaction of every cursor that opened one.
+    """
+
+    def __init__(self, db, data_dir):
+        self.db = db
+        self.data_dir = data_dir
+        self._autocommit = False
+        self._in_transaction = []
+
+    @property
+    def autocommit(self):
+        return self._autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        if value:
+            self.commit()
+        self._autocommit = value
+
+    def cursor(self, name=None):
+        # `name` (a server-side cursor in psycopg2) is accepted for compatibility and ignored.
+        return DuckDBCursor(self)
+
+    def begin(self, cursor):
+        """Open a transaction on `cursor` before its statement, unless autocommitting or already in one."""
+        if self._autocommit or cursor in self._in_transaction:
+            return
+        cursor.db.execute("BEGIN TRANSACTION")
+        self._in_transaction.append(cursor)
+
+    def commit(self):
+        self._end("COMMIT")
+
+    def rollback(self):
+        self._end("ROLLBACK")
+
+    def _end(self, statement):
+        cursors, self._in_transaction = self._in_transaction, []
+        for cursor in cursors:
+            cursor.db.execute(statement)
+            if cursor.closed:
+                cursor.db.close()
+
+    def close(self):
+        # closing DuckDB rolls back any open transaction, as closing a psycopg2 connection does
+        self.db.close()
+
+
+class DuckDBCursor:
+    """Cursor that translates Redshift SQL to DuckDB before running it."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.db = conn.db.cursor()
+        self.itersize = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def description(self):
+        return self.db.description
+
+    def execute(self, query, vars=None):
+        self.conn.begin(self)
+        for statement in translate(query, self):
+            self.db.execute(statement, vars)
+
+    def fetchone(self):
+        return self.db.fetchone()
+
+    def fetchmany(self, size=None):
+        return self.db.fetchmany(size or 1)
+
+    def fetchall(self):
+        return self.db.fetchall()
+
+    def close(self):
+        # as in psycopg2, closing a cursor leaves its transaction for the connection to commit or roll back
+        self.closed = True
+        if self not in self.conn._in_transaction:
+            self.db.close()
+
+
+_IDENTITY = re.compile(r"(\w+)\s+BIGINT\s+IDENTITY\(\s*(\d+)\s*,\s*(\d+)\s*\)", re.IGNORECASE)
+_CREATE_TABLE = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.]+)", re.IGNORECASE)
+_BARE_DECIMAL = re.compile(r"\bDECIMAL\b(?!\s*\()", re.IGNORECASE)
+_PRIMARY_KEY = re.compile(r"\s+PRIMARY\s+KEY\b", re.IGNORECASE)
+_COPY = re.compile(
+    r"^\s*COPY\s+(?P<table>[\w.]+)\s*(?:\((?P<columns>[^)]*)\))?\s*FROM\s+'(?P<source>[^']*)'(?P<options>.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+_UNLOAD = re.compile(
+    r"^\s*UNLOAD\s*\(\s*'(?P<query>(?:[^']|'')*)'\s*\)\s*TO\s+'(?P<target>[^']*)'(?P<options>.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+_EXTERNAL_SCHEMA = re.compile(r"^\s*CREATE\s+EXTERNAL\s+SCHEMA\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+_EXTERNAL_TABLE = re.compile(
+    r"^\s*CREATE\s+EXTERNAL\s+TABLE\s+(?P<table>[\w.]+)\s*\((?P<columns>(?:[^()]|\([^()]*\))*)\)"
+    r"\s*(?:PARTITIONED\s+BY\s*\((?P<partitions>[^)]*)\))?.*?LOCATION\s+'(?P<location>[^']*)'",
+    re.IGNORECASE | re.DOTALL,
+)
+_ADD_PARTITION = re.compile(
+    r"^\s*ALTER\s+TABLE\s+(?P<table>[\w.]+)\s+ADD\s+(?:IF\s+NOT\s+EXISTS\s+)?PARTITION\s*\([^)]*\)"
+    r"\s*LOCATION\s+'(?P<location>[^']*)'",
+    re.IGNORECASE | re.DOTALL,
+)
+_NO_SCHEMA_BINDING = re.compile(r"\s+WITH\s+NO\s+SCHEMA\s+BINDING\b", re.IGNORECASE)
+
+
+def translate(query, cursor):
+    """Translate one Redshift statement into the DuckDB statement(s) to run for it."""
+    copy = _COPY.match(query)
+    if copy:
+        return [translate_copy(copy, cursor)]
+    unload = _UNLOAD.match(query)
+    if unload:
+        return [translate_unload(unload, cursor)]
+    external_schema = _EXTERNAL_SCHEMA.match(query)
+    if external_schema:
+        return [f"CREATE SCHEMA IF NOT EXISTS {external_schema.group(1)};"]
+    external_table = _EXTERNAL_TABLE.match(query)
+    if external_table:
+        return [translate_external_table(external_table, cursor)]
+    add_partition = _ADD_PARTITION.match(query)
+    if add_partition:
+        # the hive-partitioned view reads every partition folder below the table location
+        location = re.sub(r"(/[^/=]+=[^/]*)+/?$", "", add_partition.group("location"))
+        return [parquet_view(add_partition.group("table"), local_path(location, cursor.conn.data_dir))]
+
+    query = re.sub(r"\bsvv_tables\b", "information_schema.tables", query, flags=re.IGNORECASE)
+    if _NO_SCHEMA_BINDING.search(query):
+        query = re.sub(r"\bpublic\.", "main.", _NO_SCHEMA_BINDING.sub("", query), flags=re.IGNORECASE)
+
+    statements = []
+    create = _CREATE_TABLE.search(query)
+    if create:
+        table = create.group(1)
+
+        def identity(match):
+            sequence = f"{table}_{match.group(1)}_seq"
+            start, step = match.group(2), match.group(3)
+            statements.append(f"CREATE SEQUENCE IF NOT EXISTS {sequence} START {start} INCREMENT {step} MINVALUE {start};")
+            return f"{match.group(1)} BIGINT DEFAULT nextval('{sequence}')"
+
+        query = _IDENTITY.sub(identity, query)
+        query = _PRIMARY_KEY.sub("", query)
+        query = _BARE_DECIMAL.sub("DECIMAL(18,0)", query)
+
+    statements.append(query)
+    return statements
+
+
+def local_path(source, data_dir):
+    """Map `s3://<bucket>/<key>` to `<data_dir>/<key>`; local paths are used as they are."""
+    if source.startswith("s3://"):
+        _, _, key = source[len("s3://"):].partition("/")
+        return os.path.join(data_dir, key)
+    return source
+
+
+def source_files(source, options, data_dir):
+    """The local JSON files a COPY reads: a manifest's entries, every `*.json` under a directory, or a file."""
+    path = local_path(source, data_dir)
+    if re.search(r"\bMANIFEST\b", options, re.IGNORECASE):
+        with open(path) as f:
+            entries = json.load(f)["entries"]
+        return [local_path(entry["url"], data_dir) for entry in entries]
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "**", "*.json"), recursive=True))
+    # a key prefix that is not a directory, e.g. s3://bucket/log_data/2018/11/2018-11-0
+    return sorted(glob.glob(path + "*.json")) or [path]
+
+
+def jsonpaths(path):
+    """The JSON keys listed, in order, by a Redshift jsonpaths file (`$['key']` or `$.key`)."""
+    with open(path) as f:
+        paths = json.load(f)["jsonpaths"]
+    return [re.match(r"^\$(?:\[['\"](.+)['\"]\]|\.(.+))$", p).group(1 if "[" in p else 2) for p in paths]
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def translate_copy(copy, cursor):
+    """Turn a Redshift COPY into `INSERT INTO ... SELECT ... FROM read_json_auto(...)`."""
+    table = copy.group("table")
+    options = copy.group("options")
+    data_dir = cursor.conn.data_dir
+
+    table_types = {row[0].lower(): (row[0], row[1].upper()) for row in cursor.db.execute(f"DESCRIBE {table}").fetchall()}
+    if copy.group("columns"):
+        columns = [c.strip() for c in copy.group("columns").split(",")]
+    else:
+        columns = [name for name, _ in table_types.values()]
+
+    json_format = re.search(r"FORMAT\s+AS\s+JSON\s+'([^']*)'", options, re.IGNORECASE)
+    if json_format is None:
+        raise ValueError("The DuckDB backend only translates COPY ... FORMAT AS JSON")
+    if json_format.group(1).lower() == "auto":
+        keys = columns
+    else:
+        keys = jsonpaths(local_path(json_format.group(1), data_dir))
+
+    files = source_files(copy.group("source"), options, data_dir)
+    reader = f"read_json_auto([{', '.join(_quote(f) for f in files)}], union_by_name = true)"
+    available = {row[0].lower(): row[0] for row in cursor.db.execute(f"DESCRIBE SELECT * FROM {reader}").fetchall()}
+
+    epoch_ms = re.search(r"TIMEFORMAT\s+AS\s+'epochmillisecs'", options, re.IGNORECASE)
+    empty_as_null = re.search(r"\b(EMPTYASNULL|BLANKSASNULL)\b", options, re.IGNORECASE)
+
+    select = []
+    for column, key in zip(columns, keys):
+        _, column_type = table_types[column.lower()]
+        if key.lower() not in available:
+            select.append(f"NULL AS {column}")
+            continue
+        value = f'"{available[key.lower()]}"'
+        # A plain CAST, so a value that does not fit the column fails the load, as it does on Redshift.
+        if column_type.startswith("TIMESTAMP") and epoch_ms:
+            value = f"epoch_ms(CAST({value} AS BIGINT))"
+        elif empty_as_null:
+            text = f"CAST({value} AS VARCHAR)"
+            value = f"CAST(CASE WHEN TRIM({text}) = '' THEN NULL ELSE {text} END AS {column_type})"
+        else:
+            value = f"CAST({value} AS {column_type})"
+        select.append(f"{value} AS {column}")
+
+    return f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(select)} FROM {reader};"
+
+
+def translate_unload(unload, cursor):
+    """Turn a Redshift `UNLOAD ... FORMAT AS PARQUET` into a DuckDB `COPY (...) TO` a local Parquet file."""
+    if not re.search(r"FORMAT\s+AS\s+PARQUET", unload.group("options"), re.IGNORECASE):
+        raise ValueError("The DuckDB backend only translates UNLOAD ... FORMAT AS PARQUET")
+    # Redshift names the files <prefix><slice>_part_<nn>.parquet
+    target = local_path(unload.group("target"), cursor.conn.data_dir) + "0000_part_00.parquet"
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    query = unload.group("query").replace("''", "'")
+    return f"COPY ({query}) TO {_quote(target)} (FORMAT PARQUET);"
+
+
+def parquet_view(table, location):
+    """A view over every Parquet file below `location`, with the hive-style `key=value` folders as columns."""
+    files = os.path.join(location, "**", "*.parquet")
+    return (f"CREATE OR REPLACE VIEW {table} AS SELECT * FROM "
+            f"read_parquet({_quote(files)}, hive_partitioning = true, union_by_name = true);")
+
+
+def translate_external_table(external_table, cursor):
+    """Turn a Spectrum external table into a view over its local Parquet files (empty while there are none)."""
+    table = external_table.group("table")
+    location = local_path(external_table.group("location"), cursor.conn.data_dir)
+    if glob.glob(os.path.join(location, "**", "*.parquet"), recursive=True):
+        return parquet_view(table, location)
+
+    columns = external_table.group("columns") + "," + (external_table.group("partitions") or "")
+    definitions = [c.strip().split(None, 1) for c in re.split(r",(?![^()]*\))", columns) if c.strip()]
+    select = ", ".join(f"CAST(NULL AS {type_}) AS {name}" for name, type_ in definitions)
+    return f"CREATE OR REPLACE VIEW {table} AS SELECT {select} WHERE FALSE;"
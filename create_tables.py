@@ -1,30 +1,26 @@
-import configparser
-import psycopg2
-from sql_queries_create_tables import create_table_queries, drop_table_queries
+from dwh_config import connect
+from sql_templates import create_table_queries, drop_table_queries
 
 
-def drop_tables(cur, conn):
+def drop_tables(cur, conn, schema=None):
     """Run drop tables SQL queries"""
-    for query in drop_table_queries:
+    for query in drop_table_queries(schema):
         cur.execute(query)
         conn.commit()
 
 
-def create_tables(cur, conn):
+def create_tables(cur, conn, schema=None):
     """Run create tables SQL queries"""
-    for query in create_table_queries:
+    for query in create_table_queries(schema):
         cur.execute(query)
         conn.commit()
 
 
 def main():
     """Create a fresh set of tables (and drop old if exists)"""
-    config = configparser.ConfigParser()
-    
-    # the file is auto-generated based on the template `dwh_030_access.cfg`
-    config.read('dwh_035_access.cfg')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    # connects using `dwh_035_access.cfg`, auto-generated by `create_cluster.py`
+    conn = connect()
     cur = conn.cursor()
 
     drop_tables(cur, conn)
@@ -38,4 +34,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,77 @@
+"""
+Shared helpers for reading the `.cfg` files and connecting to the Sparkify Redshift database.
+
+- `dwh_010_secret.cfg`: AWS admin key and secret.
+- `dwh_020_build.cfg`: parameters used to spin up (and delete) the cluster.
+- `dwh_035_access.cfg`: auto-generated by `create_cluster.py`, used to connect to the database.
+
+psycopg2 is only imported when a connection is actually opened.
+"""
+
+import configparser
+
+
+SECRET_CFG = 'dwh_010_secret.cfg'
+BUILD_CFG = 'dwh_020_build.cfg'
+ACCESS_CFG = 'dwh_035_access.cfg'
+
+
+def read_config(path):
+    """Read a `.cfg` file, failing loudly if it is not there."""
+    config = configparser.ConfigParser()
+    with open(path) as f:
+        config.read_file(f)
+    return config
+
+
+def load_build_params(secret_path=SECRET_CFG, build_path=BUILD_CFG):
+    """Load the AWS secret and Redshift cluster build parameters into one dict."""
+    config_secret = read_config(secret_path)
+    config_dwh = read_config(build_path)
+
+    params = {
+        "AWS_KEY": config_secret.get('AWS', 'ADMIN_KEY'),
+        "AWS_SECRET": config_secret.get('AWS', 'ADMIN_SECRET'),
+        "AWS_REGION": config_dwh.get("AWS", "REGION"),
+        "DWH_CLUSTER_TYPE": config_dwh.get("DWH", "DWH_CLUSTER_TYPE"),
+        "DWH_NUM_NODES": 1,
+        "DWH_NODE_TYPE": config_dwh.get("DWH", "DWH_NODE_TYPE"),
+        "DWH_CLUSTER_IDENTIFIER": config_dwh.get("DWH", "DWH_CLUSTER_IDENTIFIER"),
+        "DWH_DB": config_dwh.get("DWH", "DWH_DB"),
+        "DWH_DB_USER": config_dwh.get("DWH", "DWH_DB_USER"),
+        "DWH_DB_PASSWORD": config_dwh.get("DWH", "DWH_DB_PASSWORD"),
+        "DWH_PORT": config_dwh.get("DWH", "DWH_PORT"),
+        "DWH_IAM_ROLE_NAME": config_dwh.get("DWH", "DWH_IAM_ROLE_NAME"),
+        "DWH_IAM_ROLE_POLICY": config_dwh.get("DWH", "DWH_IAM_ROLE_POLICY"),
+        "S3_LOG_DATA": config_dwh.get("S3", "LOG_DATA"),
+        "S3_LOG_JSONPATH": config_dwh.get("S3", "LOG_JSONPATH"),
+        "S3_SONG_DATA": config_dwh.get("S3", "SONG_DATA"),
+    }
+
+    # optional: songplays hot/cold tiering (see tiering.py)
+    if config_dwh.has_section("TIERING"):
+        for option in ("ARCHIVE", "RETAIN_MONTHS", "EXTERNAL_SCHEMA", "CATALOG_DATABASE"):
+            if config_dwh.has_option("TIERING", option):
+                params[f"TIERING_{option}"] = config_dwh.get("TIERING", option)
+
+    if params["DWH_CLUSTER_TYPE"] == 'multi-node':
+        params["DWH_NUM_NODES"] = config_dwh.getint("DWH", "DWH_NUM_NODES")
+        assert params["DWH_NUM_NODES"] > 1, "DWH_NUM_NODES must be greater than 1 for a multi-node cluster"
+
+    return params
+
+
+def print_params(params, hidden=("AWS_KEY", "AWS_SECRET")):
+    """Print a parameter dict as a two column table (secrets left out)."""
+    rows = [(k, v) for k, v in params.items() if k not in hidden]
+    width = max(len(k) for k, _ in rows)
+    for k, v in rows:
+        print(f"{k:<{width}}  {v}")
+
+
+def connect(access_path=ACCESS_CFG):
+    """Connect to the Sparkify Redshift database described by `dwh_035_access.cfg`."""
+    import psycopg2
+
+    config = read_config(access_path)
+    return psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
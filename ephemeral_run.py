@@ -0,0 +1,385 @@
+"""
+Run the whole ETL on a short-lived Redshift cluster, sized from recorded timings.
+
+Instead of leaving a fixed `dwh_020_build.cfg` cluster running between manual `create_cluster.py` and
+`delete_cluster.py` runs, this script:
+
+1. Measures the input size (GB under the S3 log and song prefixes).
+2. Estimates the ETL time and cost of every candidate node type and count from the timings recorded by
+   earlier runs (`dwh_040_benchmarks.json`), and prints the trade-off.
+3. Picks the cheapest candidate that meets `--deadline-minutes` (or the cheapest overall).
+4. Provisions that cluster (`provision.py`) under a run-specific identifier
+   (`<DWH_CLUSTER_IDENTIFIER>-<UTC timestamp>`), creates the tables and runs the ETL to completion.
+5. Records the new timings, and tears the cluster down, also when a step fails.
+
+Only what the run created is torn down: the cluster of `dwh_020_build.cfg` (if any) is never touched,
+and the IAM role is only deleted when the run had to create it. Should the run-specific cluster exist
+already, the run stops before touching it. The connection details of the run-specific cluster go to
+their own `dwh_035_access.<cluster identifier>.cfg`, so `dwh_035_access.cfg` keeps pointing at the
+`create_cluster.py` cluster; the file is deleted with the cluster, or kept with `--keep-cluster`.
+
+The sizing model assumes load and insert work spread evenly over the cluster slices, so a step's
+time is `seconds per GB per slice x GB / total slices`, where `seconds per GB per slice` is the median
+over the recorded runs. With no recorded runs yet, the cluster spec in `dwh_020_build.cfg` is used
+(and the run records the first timings). The cost of an option bills its whole run time
+(provisioning and table creation included) at approximate on-demand USD per node-hour;
+edit `NODE_TYPES` for your region and pricing.
+
+Usage:
+
+    python ephemeral_run.py                         (or: python sparkify.py ephemeral-run)
+    python sparkify.py ephemeral-run --deadline-minutes 20
+    python sparkify.py ephemeral-run --dry-run      (print the sizing report only)
+
+For testing, `run_ephemeral` takes the boto3 clients (e.g. under moto's `mock_aws`), a `connect`
+function (e.g. to a local Postgres) and the list of ETL steps to run.
+"""
+
+import dataclasses
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+
+from dwh_config import connect, load_build_params, print_params
+
+
+BENCHMARKS_FILE = 'dwh_040_benchmarks.json'
+
+# slices: parallel load streams per node. price: approximate on-demand USD per node-hour.
+NODE_TYPES = {
+    "dc2.large":    {"slices": 2,  "price": 0.25,  "min_nodes": 1},
+    "dc2.8xlarge":  {"slices": 16, "price": 4.80,  "min_nodes": 2},
+    "ra3.xlplus":   {"slices": 2,  "price": 1.086, "min_nodes": 1},
+    "ra3.4xlarge":  {"slices": 4,  "price": 3.26,  "min_nodes": 2},
+    "ra3.16xlarge": {"slices": 16, "price": 13.04, "min_nodes": 2},
+}
+
+NODE_COUNTS = [1, 2, 4, 8]
+
+# Steps whose timings scale with the input size (the rest of the run is fixed overhead).
+SIZED_STEPS = ["load_staging_tables", "insert_tables"]
+
+# Redshift bills per second, with a 60 second minimum.
+MIN_BILLED_SECONDS = 60
+
+
+@dataclasses.dataclass
+class SizingOption:
+    """Estimated ETL time and cost of one cluster size."""
+    node_type: str
+    num_nodes: int
+    etl_seconds: float
+    total_seconds: float
+    cost: float
+
+
+# BENCHMARK RECORDS
+
+def load_benchmarks(path=BENCHMARKS_FILE):
+    """Load the recorded timings (a list of dicts), or an empty list when there are none yet."""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def record_benchmarks(records, path=BENCHMARKS_FILE):
+    """Append new timing records to the benchmarks file."""
+    all_records = load_benchmarks(path) + records
+    with open(path, 'w') as f:
+        json.dump(all_records, f, indent=2)
+
+
+def input_gb(s3, *s3_uris):
+    """Total size in GB of the objects under the given `s3://bucket/prefix` URIs."""
+    total = 0
+    paginator = s3.get_paginator('list_objects_v2')
+    for uri in s3_uris:
+        bucket, _, prefix = uri.replace("s3://", "", 1).partition("/")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            total += sum(obj['Size'] for obj in page.get('Contents', []))
+    return total / 1024 ** 3
+
+
+# SIZING
+
+def seconds_per_gb_slice(records):
+    """Median `seconds x slices / GB` per sized step, over the recorded runs (of node types in `NODE_TYPES`)."""
+    samples = {}
+    for r in records:
+        if r["step"] in SIZED_STEPS and r.get("gb") and r["node_type"] in NODE_TYPES:
+            slices = NODE_TYPES[r["node_type"]]["slices"] * r["num_nodes"]
+            samples.setdefault(r["step"], []).append(r["seconds"] * slices / r["gb"])
+    return {step: statistics.median(values) for step, values in samples.items()}
+
+
+def overhead_seconds(records):
+    """Average time per run of the steps that do not scale with the input (provisioning, create tables...)."""
+    samples = [r["seconds"] for r in records if r["step"] not in SIZED_STEPS]
+    runs = {r.get("run_id") for r in records if r["step"] not in SIZED_STEPS}
+    return sum(samples) / len(runs) if runs else 0.0
+
+
+def size_options(records, gb, node_types=NODE_TYPES, node_counts=NODE_COUNTS):
+    """Estimate every candidate cluster size. Returns [] when there are no recorded timings to go on."""
+    per_gb_slice = seconds_per_gb_slice(records)
+    if not per_gb_slice:
+        return []
+    overhead = overhead_seconds(records)
+
+    options = []
+    for node_type, spec in node_types.items():
+        for num_nodes in node_counts:
+            if num_nodes < spec["min_nodes"]:
+                continue
+            slices = spec["slices"] * num_nodes
+            etl_seconds = sum(s * gb / slices for s in per_gb_slice.values())
+            total_seconds = etl_seconds + overhead
+            # the cluster is billed for the whole run, not only the ETL steps
+            billed_hours = max(total_seconds, MIN_BILLED_SECONDS) / 3600
+            options.append(SizingOption(
+                node_type=node_type,
+                num_nodes=num_nodes,
+                etl_seconds=etl_seconds,
+                total_seconds=total_seconds,
+                cost=billed_hours * spec["price"] * num_nodes,
+            ))
+    return sorted(options, key=lambda o: (o.cost, o.total_seconds))
+
+
+def choose_option(options, deadline_seconds=None):
+    """The cheapest option that finishes within the deadline (or the fastest one if none does)."""
+    if deadline_seconds is not None:
+        in_time = [o for o in options if o.total_seconds <= deadline_seconds]
+        if not in_time:
+            return min(options, key=lambda o: o.total_seconds)
+        options = in_time
+    return min(options, key=lambda o: (o.cost, o.total_seconds))
+
+
+def print_sizing_report(options, chosen, gb):
+    """Print the time/cost trade-off of every option, marking the chosen one."""
+    print(f"Input size: {gb:.3f} GB")
+    print(f"{'node_type':<14} {'nodes':>5} {'etl min':>8} {'total min':>10} {'cost USD':>9}")
+    for o in options:
+        mark = "  <-- chosen" if o == chosen else ""
+        print(f"{o.node_type:<14} {o.num_nodes:>5} {o.etl_seconds / 60:>8.1f} {o.total_seconds / 60:>10.1f} {o.cost:>9.3f}{mark}")
+
+
+def sized_params(params, node_type, num_nodes):
+    """Copy of the build parameters with the cluster spec replaced."""
+    return dict(
+        params,
+        DWH_NODE_TYPE=node_type,
+        DWH_NUM_NODES=num_nodes,
+        DWH_CLUSTER_TYPE="single-node" if num_nodes == 1 else "multi-node",
+    )
+
+
+# RUN
+
+def ephemeral_cluster_identifier(base, now):
+    """A cluster identifier for a run started at `now`: `base` plus a UTC timestamp, within Redshift's 63 characters."""
+    suffix = now.strftime("%Y%m%d-%H%M%S")
+    return f"{base[:63 - len(suffix) - 1].rstrip('-')}-{suffix}"
+
+
+def ephemeral_access_path(cluster_identifier):
+    """Where the connection details of a run-specific cluster are written (next to `dwh_035_access.cfg`)."""
+    return f"dwh_035_access.{cluster_identifier}.cfg"
+
+
+def _create_tables(cur, conn, access_path):
+    from create_tables import create_tables, drop_tables
+
+    drop_tables(cur, conn)
+    create_tables(cur, conn)
+
+
+def _load_staging_tables(cur, conn, access_path):
+    from etl_stage import load_staging_tables
+    from sql_templates import LoadParams
+
+    load_staging_tables(cur, conn, LoadParams.from_config(access_path))
+
+
+def _insert_tables(cur, conn, access_path):
+    from etl_star import insert_tables
+    from sql_templates import LoadParams
+
+    insert_tables(cur, conn, LoadParams.from_config(access_path))
+
+
+# (name, function(cur, conn, access_path)) run in order on the fresh cluster
+ETL_STEPS = [
+    ("create_tables", _create_tables),
+    ("load_staging_tables", _load_staging_tables),
+    ("insert_tables", _insert_tables),
+]
+
+
+def run_ephemeral(params, clients, gb, connect=connect, steps=ETL_STEPS, keep_cluster=False,
+                  access_path=None, benchmarks_path=BENCHMARKS_FILE, sleep=time.sleep):
+    """
+    Provision a run-specific cluster sized as in `params`, run `steps`, record their timings and tear down.
+
+    The cluster is torn down (unless `keep_cluster`) however the run ends, and so is the IAM role when
+    this run created it. The cluster's access config is written to `access_path` (default:
+    `ephemeral_access_path(cluster identifier)`), handed to `connect` and the steps, and deleted with the
+    cluster. A step that raises stops the run; its error is reported, not raised.
+    Returns a dict with the `cluster_identifier`, the `access_path`, the per-step `timings`, the
+    `provision` and `teardown` results, the `error` that stopped the run (or None), and `ok`.
+    """
+    from provision import CREATED, EXISTS, FAILED, provision, teardown
+
+    started = datetime.datetime.now(datetime.timezone.utc)
+    run_id = started.isoformat()
+    params = dict(params, DWH_CLUSTER_IDENTIFIER=ephemeral_cluster_identifier(params["DWH_CLUSTER_IDENTIFIER"], started))
+    access_path = access_path or ephemeral_access_path(params["DWH_CLUSTER_IDENTIFIER"])
+    timings = []
+    report = {"cluster_identifier": params["DWH_CLUSTER_IDENTIFIER"], "access_path": access_path, "timings": timings,
+              "provision": None, "teardown": None, "error": None, "ok": False}
+    created = {"redshift_cluster": True, "iam_role": False}
+
+    try:
+        start = time.perf_counter()
+        result = report["provision"] = provision(clients, params, access_path=access_path, sleep=sleep)
+        timings.append(("provision", time.perf_counter() - start))
+        created = {name: result.step(name).status == CREATED for name in created}
+        if result.step("redshift_cluster").status == EXISTS:
+            report["error"] = (f"cluster {params['DWH_CLUSTER_IDENTIFIER']} already existed: "
+                               f"stopped without using or deleting it")
+            return report
+        if not result.ok:
+            failed = "; ".join(f"{step.name}: {step.detail}" for step in result.steps if step.status == FAILED)
+            report["error"] = f"provisioning failed ({failed})"
+            return report
+
+        conn = connect(access_path)
+        cur = conn.cursor()
+        try:
+            for name, func in steps:
+                start = time.perf_counter()
+                try:
+                    func(cur, conn, access_path)
+                except Exception as e:
+                    report["error"] = f"{name}: {type(e).__name__}: {e}"
+                    return report
+                timings.append((name, time.perf_counter() - start))
+        finally:
+            conn.close()
+
+        record_benchmarks([
+            {
+                "run_id": run_id,
+                "node_type": result.node_type,
+                "num_nodes": int(result.num_nodes),
+                "step": name,
+                "gb": gb,
+                "seconds": seconds,
+            }
+            for name, seconds in timings
+        ], benchmarks_path)
+        report["ok"] = True
+    finally:
+        if not keep_cluster and (created["redshift_cluster"] or created["iam_role"]):
+            report["teardown"] = teardown(clients, params, sleep=sleep, keep_role=not created["iam_role"],
+                                          keep_cluster=not created["redshift_cluster"])
+        if not keep_cluster and os.path.exists(access_path):
+            os.remove(access_path)
+
+    return report
+
+
+def check_cluster_size(node_type=None, num_nodes=None):
+    """Raise `ValueError` unless `node_type`/`num_nodes` (as given to `main`) can be sized and recorded."""
+    if num_nodes is not None and not node_type:
+        raise ValueError("num_nodes needs node_type")
+    if node_type is None:
+        return
+    if node_type not in NODE_TYPES:
+        raise ValueError(f"Unknown node type {node_type!r}: use one of {', '.join(NODE_TYPES)} (or add it to NODE_TYPES)")
+    if (num_nodes or 1) < NODE_TYPES[node_type]["min_nodes"]:
+        raise ValueError(f"{node_type} needs at least {NODE_TYPES[node_type]['min_nodes']} nodes")
+
+
+def plan_run(params, records, gb, deadline_minutes=None, node_type=None, num_nodes=None):
+    """Pick the cluster size to run on and print why. Returns the sized parameters."""
+    check_cluster_size(node_type, num_nodes)
+    if node_type:
+        print(f"Using the requested cluster size: {num_nodes or 1} x {node_type}")
+        return sized_params(params, node_type, num_nodes or 1)
+
+    options = size_options(records, gb)
+    if not options:
+        print(f"No timings recorded in {BENCHMARKS_FILE} yet: using the dwh_020_build.cfg cluster spec "
+              f"({params['DWH_NUM_NODES']} x {params['DWH_NODE_TYPE']}). This run will record the first timings.")
+        return params
+
+    deadline_seconds = deadline_minutes * 60 if deadline_minutes is not None else None
+    chosen = choose_option(options, deadline_seconds)
+    print_sizing_report(options, chosen, gb)
+    if deadline_seconds is not None and chosen.total_seconds > deadline_seconds:
+        print(f"No option meets the {deadline_minutes} minute deadline: using the fastest.")
+    return sized_params(params, chosen.node_type, chosen.num_nodes)
+
+
+def main(deadline_minutes=None, node_type=None, num_nodes=None, keep_cluster=False, dry_run=False, gb=None):
+    """Size, provision, run the ETL on, and tear down a short-lived Redshift cluster."""
+    print("*******************************************")
+    print("Load AWS Secret and Redshift Datawarehouse Parameters")
+    params = load_build_params()
+    records = load_benchmarks()
+
+    print("*******************************************")
+    print("Size the cluster")
+    clients = None
+    if gb is None:
+        if dry_run:
+            # Don't touch AWS on a dry run: reuse the input size of the last recorded run.
+            gb = records[-1]["gb"] if records else 0.0
+        else:
+            from provision import create_clients
+
+            clients = create_clients(params)
+            gb = input_gb(clients["s3"], params["S3_LOG_DATA"], params["S3_SONG_DATA"])
+    params = plan_run(params, records, gb, deadline_minutes, node_type, num_nodes)
+
+    if dry_run:
+        return
+
+    if clients is None:
+        from provision import create_clients
+
+        clients = create_clients(params)
+
+    print("*******************************************")
+    print(f"Run the ETL on {params['DWH_NUM_NODES']} x {params['DWH_NODE_TYPE']}")
+    print_params(params)
+    report = run_ephemeral(params, clients, gb, keep_cluster=keep_cluster)
+
+    print("*******************************************")
+    print(f"Provisioning {report['cluster_identifier']}")
+    if report["provision"] is not None:
+        report["provision"].print_summary()
+    print("Step timings")
+    for name, seconds in report["timings"]:
+        print(f"{name:<20} {seconds:10.1f}s")
+    if report["teardown"] is not None:
+        print("Teardown")
+        report["teardown"].print_summary()
+    elif keep_cluster and os.path.exists(report["access_path"]):
+        print(f"The cluster is kept: its connection details are in {report['access_path']}")
+
+    if not report["ok"]:
+        print("*******************************************")
+        print(f"The run did not complete: {report['error']}. See the tables above.")
+        sys.exit(1)
+    print(f"Timings recorded in {BENCHMARKS_FILE}")
+
+
+if __name__ == "__main__":
+    main()
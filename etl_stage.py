@@ -1,18 +1,27 @@
-import configparser
-import psycopg2
-from sql_queries_etl_stage import copy_table_queries
+from dwh_config import connect
+from sql_templates import LoadParams, copy_table_queries, dedup_staging_queries
 
 
-def load_staging_tables(cur, conn):
-    for query in copy_table_queries:
+def load_staging_tables(cur, conn, params=None):
+    """
+    Extract and Transform S3 files, then load into Redshift Staging Tables.
+
+    `params` (a `LoadParams`) defaults to the sources in `dwh_035_access.cfg`.
+    """
+    params = params or LoadParams.from_config()
+    for query in copy_table_queries(params):
         cur.execute(query)
         conn.commit()
 
-def main():
-    config = configparser.ConfigParser()
-    config.read('dwh_035_access.cfg')
+    # one transaction: the staged rows are deleted and re-inserted together, or not at all
+    for query in dedup_staging_queries(params):
+        cur.execute(query)
+    conn.commit()
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+
+def main():
+    """Build the staging tables."""
+    conn = connect()
     cur = conn.cursor()
     
     load_staging_tables(cur, conn)
@@ -21,4 +30,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,25 +1,42 @@
-import configparser
-import psycopg2
-from sql_queries_etl_star import insert_table_queries
+from dwh_config import connect
+from sql_templates import LoadParams, insert_table_queries, user_table_queries, user_versions_missed_query
+from tiering import tier_songplays
 
 
-def insert_tables(cur, conn):
-    for query in insert_table_queries:
+def insert_tables(cur, conn, params=None):
+    """
+    Extract and Transform Redshift Staging Tables, then load into Redshift STAR-schema Tables.
+
+    `params` (a `LoadParams`) defaults to `dwh_035_access.cfg`, all events, default schema.
+    """
+    params = params or LoadParams.from_config()
+
+    # one transaction: a user version is closed together with the insert of the one replacing it, or not at all
+    for query in user_table_queries(params):
+        cur.execute(query)
+    conn.commit()
+
+    for query in insert_table_queries(params):
         cur.execute(query)
         conn.commit()
 
+    cur.execute(user_versions_missed_query(params))
+    row = cur.fetchone()
+    if row and row[0]:
+        print(f"WARNING: {row[0]} staged events change a user between two versions already in users and were "
+              f"not recorded as new versions. Load date windows in order (oldest first) to keep every change.")
 
-def main():
-    config = configparser.ConfigParser()
-    config.read('dwh_035_access.cfg')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+def main():
+    """Build the STAR-schema tables from the staging tables, then tier songplays (if set up)."""
+    conn = connect()
     cur = conn.cursor()
     
     insert_tables(cur, conn)
+    tier_songplays(cur, conn)
 
     conn.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
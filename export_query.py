@@ -0,0 +1,383 @@
+"""
+Stream query results out of Redshift to CSV, NDJSON or Parquet with flat memory use.
+
+The default psycopg2 cursor pulls the whole result set into Python before the first row can be used.
+This script uses a named (server-side) cursor instead and pulls the result in `fetchmany` batches,
+writing each batch out before fetching the next one. Only one batch (plus a few compressed chunks
+waiting to be written) is ever held in memory, however big the result is.
+
+Usage:
+
+    python export_query.py "SELECT * FROM songplays" songplays.csv
+    python export_query.py "SELECT * FROM songplays" songplays.ndjson --compress
+    python export_query.py "SELECT * FROM songplays" songplays.parquet --batch-size 50000
+    python export_query.py "SELECT * FROM songplays" --benchmark
+
+- The output format is taken from the file extension (`.csv`, `.ndjson`/`.jsonl`, `.parquet`), or from `--format`.
+- `--compress` gzips CSV/NDJSON output in a background thread, so compression overlaps with fetching.
+  For Parquet it switches on the (column-chunk level) gzip codec instead.
+- `--benchmark` fetches the query with a range of batch sizes (or only `--batch-size`, when given),
+  serialises it to `--format` (default CSV) and prints rows/sec and peak Python memory per batch
+  size, without writing anything to disk.
+
+Parquet output needs `pyarrow` (`pip install pyarrow`). It is only imported when Parquet is used.
+
+Like the other scripts, it connects using the auto-generated `dwh_035_access.cfg`.
+"""
+
+import argparse
+import csv
+import datetime
+import decimal
+import gzip
+import io
+import json
+import queue
+import threading
+import time
+import tracemalloc
+
+from dwh_config import connect
+
+
+DEFAULT_BATCH_SIZE = 10000
+
+BENCHMARK_BATCH_SIZES = [100, 1000, 10000, 50000]
+
+FORMATS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".parquet": "parquet",
+}
+
+
+# STREAMING
+
+def stream_batches(conn, query, batch_size=DEFAULT_BATCH_SIZE, cursor_name="sparkify_export"):
+    """
+    Run `query` on a named (server-side) cursor and yield the result one batch at a time.
+
+    Yields `(description, rows)` tuples, where `description` is the DB-API cursor description
+    and `rows` a list of at most `batch_size` tuples. The first batch is always yielded, even when
+    the result is empty, so a writer can lay out the columns of an empty result.
+    """
+    # Named cursors only live inside a transaction, which psycopg2 opens for us.
+    with conn.cursor(name=cursor_name) as cur:
+        cur.itersize = batch_size
+        cur.execute(query)
+        # a named cursor only has a description once the first rows are fetched
+        rows = cur.fetchmany(batch_size)
+        yield cur.description, rows
+        while rows:
+            rows = cur.fetchmany(batch_size)
+            if rows:
+                yield cur.description, rows
+    conn.commit()
+
+
+# OUTPUT SINKS
+
+class BackgroundGzipSink:
+    """
+    Binary sink that gzips and writes chunks in a background thread.
+
+    `write()` hands the chunk over through a bounded queue, so the fetching thread only blocks when
+    the compressor falls more than `max_pending` chunks behind. That bound is what keeps memory flat.
+    Closing the sink flushes the compressor and closes `fileobj`.
+    """
+
+    _DONE = object()
+
+    def __init__(self, fileobj, max_pending=4, compresslevel=6):
+        self._fileobj = fileobj
+        self._gzip = gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=compresslevel)
+        self._chunks = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="gzip-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            chunk = self._chunks.get()
+            if chunk is self._DONE:
+                break
+            if self._error is None:
+                try:
+                    self._gzip.write(chunk)
+                except Exception as e:
+                    self._error = e
+
+    def write(self, chunk):
+        if self._error is not None:
+            raise self._error
+        self._chunks.put(chunk)
+
+    def close(self):
+        self._chunks.put(self._DONE)
+        self._thread.join()
+        self._gzip.close()
+        self._fileobj.close()
+        if self._error is not None:
+            raise self._error
+
+
+class CountingSink:
+    """Binary sink that throws the data away and only counts bytes (used by the benchmark)."""
+
+    closed = False  # pyarrow checks this before writing to a file-like object
+
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, chunk):
+        self.bytes_written += len(chunk)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# WRITERS
+
+def _json_default(value):
+    """Serialise the non-JSON types psycopg2 hands back."""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class CsvWriter:
+    """Write batches as CSV (with a header row) to a binary sink."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._header_written = False
+
+    def write_batch(self, description, rows):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if not self._header_written:
+            writer.writerow([col[0] for col in description])
+            self._header_written = True
+        writer.writerows(rows)
+        self.sink.write(buf.getvalue().encode("utf-8"))
+
+    def close(self):
+        self.sink.close()
+
+
+class NdjsonWriter:
+    """Write batches as newline-delimited JSON (one object per row) to a binary sink."""
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def write_batch(self, description, rows):
+        if not rows:
+            return
+        columns = [col[0] for col in description]
+        lines = [json.dumps(dict(zip(columns, row)), default=_json_default) for row in rows]
+        self.sink.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def close(self):
+        self.sink.close()
+
+
+# Postgres/Redshift type OIDs -> Arrow type names (anything else is written as a string).
+# The schema is taken from the cursor description rather than inferred from the first batch,
+# so a batch that happens to be all NULL in one column does not break the file schema.
+# NUMERIC keeps its precision and scale (or is written as a string when the description has none),
+# TIMESTAMPTZ is written in UTC.
+_ARROW_TYPES = {
+    16: "bool_",
+    20: "int64",
+    21: "int16",
+    23: "int32",
+    700: "float32",
+    701: "float64",
+    1700: "decimal",
+    1082: "date32",
+    1114: "timestamp",
+    1184: "timestamptz",
+}
+
+
+class ParquetWriter:
+    """Write batches as row groups of a single Parquet file (needs `pyarrow`). `path` may also be a file-like sink."""
+
+    def __init__(self, path, compression=None):
+        self.path = path
+        self.compression = compression or "snappy"
+        self._writer = None
+        self._schema = None
+
+    def _make_schema(self, description):
+        import pyarrow as pa
+
+        fields = []
+        for col in description:
+            type_name = _ARROW_TYPES.get(col[1], "string")
+            if type_name == "decimal":
+                precision, scale = col[4], col[5]
+                arrow_type = pa.decimal128(precision, scale or 0) if precision else pa.string()
+            elif type_name == "timestamp":
+                arrow_type = pa.timestamp("us")
+            elif type_name == "timestamptz":
+                arrow_type = pa.timestamp("us", tz="UTC")
+            else:
+                arrow_type = getattr(pa, type_name)()
+            fields.append(pa.field(col[0], arrow_type))
+        return pa.schema(fields)
+
+    def write_batch(self, description, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            self._schema = self._make_schema(description)
+            self._writer = pq.ParquetWriter(self.path, self._schema, compression=self.compression)
+        if not rows:
+            return
+
+        columns = list(zip(*rows))
+        arrays = []
+        for field, values in zip(self._schema, columns):
+            if pa.types.is_floating(field.type):
+                values = [None if v is None else float(v) for v in values]
+            elif pa.types.is_string(field.type):
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(pa.array(values, type=field.type))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+# EXPORT
+
+def guess_format(path):
+    """Work out the output format from the file extension (ignoring a trailing `.gz`)."""
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for ext, fmt in FORMATS.items():
+        if name.endswith(ext):
+            return fmt
+    raise ValueError(f"Cannot tell the output format of {path}: use one of {sorted(FORMATS)} or pass --format")
+
+
+def open_writer(path, fmt, compress=False):
+    """Open the writer for `fmt` on `path` (a file name, or a binary file-like sink)."""
+    if fmt == "parquet":
+        return ParquetWriter(path, compression="gzip" if compress else None)
+
+    fileobj = open(path, "wb") if isinstance(path, str) else path
+    sink = BackgroundGzipSink(fileobj) if compress else fileobj
+
+    if fmt == "csv":
+        return CsvWriter(sink)
+    if fmt == "ndjson":
+        return NdjsonWriter(sink)
+    raise ValueError(f"Unknown output format: {fmt}")
+
+
+def export_query(conn, query, path, fmt=None, batch_size=DEFAULT_BATCH_SIZE, compress=False):
+    """
+    Stream the result of `query` into `path`. Returns the number of rows written.
+
+    `fmt` defaults to the format implied by the file extension.
+    """
+    fmt = fmt or guess_format(path)
+    if compress and fmt != "parquet" and not path.endswith(".gz"):
+        path += ".gz"
+
+    writer = open_writer(path, fmt, compress=compress)
+    row_count = 0
+    try:
+        for description, rows in stream_batches(conn, query, batch_size=batch_size):
+            writer.write_batch(description, rows)
+            row_count += len(rows)
+    finally:
+        writer.close()
+
+    print(f"Exported {row_count} rows to {path}")
+    return row_count
+
+
+# BENCHMARK
+
+def benchmark(conn, query, batch_sizes=BENCHMARK_BATCH_SIZES, fmt="csv"):
+    """
+    Fetch `query` once per batch size, serialising to `fmt` (csv, ndjson or parquet) but discarding the output.
+
+    Returns a list of dicts (batch_size, rows, seconds, rows_per_sec, peak_mb).
+    `peak_mb` is the peak Python heap use measured with tracemalloc; it should track the batch size,
+    not the result size.
+    """
+    results = []
+    for batch_size in batch_sizes:
+        sink = CountingSink()
+        writer = open_writer(sink, fmt)
+        row_count = 0
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        for description, rows in stream_batches(conn, query, batch_size=batch_size):
+            writer.write_batch(description, rows)
+            row_count += len(rows)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        writer.close()
+
+        results.append({
+            "batch_size": batch_size,
+            "rows": row_count,
+            "seconds": seconds,
+            "rows_per_sec": row_count / seconds if seconds else float("inf"),
+            "peak_mb": peak / 1024 / 1024,
+        })
+
+    print(f"Format: {fmt}")
+    print(f"{'batch_size':>10} {'rows':>10} {'seconds':>10} {'rows/sec':>12} {'peak MB':>10}")
+    for r in results:
+        print(f"{r['batch_size']:>10} {r['rows']:>10} {r['seconds']:>10.2f} {r['rows_per_sec']:>12.0f} {r['peak_mb']:>10.1f}")
+
+    return results
+
+
+def main():
+    """Export a query result to file (or benchmark the export) from the command line."""
+    parser = argparse.ArgumentParser(description="Stream a Redshift query result to CSV, NDJSON or Parquet.")
+    parser.add_argument("query", help="SQL query to export, e.g. \"SELECT * FROM songplays\"")
+    parser.add_argument("path", nargs="?", help="output file (.csv, .ndjson, .jsonl or .parquet)")
+    parser.add_argument("--format", choices=sorted(set(FORMATS.values())), help="output format (default: from extension)")
+    parser.add_argument("--batch-size", type=int,
+                        help=f"rows per fetchmany batch (default: {DEFAULT_BATCH_SIZE}; with --benchmark: only this size)")
+    parser.add_argument("--compress", action="store_true", help="gzip output (in a background thread for CSV/NDJSON)")
+    parser.add_argument("--benchmark", action="store_true", help="print rows/sec vs batch size instead of exporting")
+    args = parser.parse_args()
+
+    if not args.benchmark and not args.path:
+        parser.error("path is required unless --benchmark is given")
+
+    conn = connect()
+
+    if args.benchmark:
+        batch_sizes = [args.batch_size] if args.batch_size else BENCHMARK_BATCH_SIZES
+        benchmark(conn, args.query, batch_sizes=batch_sizes, fmt=args.format or "csv")
+    else:
+        export_query(conn, args.query, args.path, fmt=args.format, batch_size=args.batch_size or DEFAULT_BATCH_SIZE,
+                     compress=args.compress)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+"""
+Provision (and tear down) the Sparkify Redshift cluster and its IAM role.
+
+Used by `create_cluster.py` and `delete_cluster.py`. Compared to polling in a busy loop:
+
+- Waiting uses exponential backoff with a timeout (`wait_until`), instead of checking every 5 seconds forever.
+- Steps that do not depend on each other run concurrently:
+    - provision: the role policy is attached while the cluster is being created, and the security group
+      ingress rule is opened while we wait for the cluster to become available.
+    - teardown: the IAM role is removed while the cluster is being deleted.
+- Every step is idempotent: resources that already exist (or are already gone) are reported as such and
+  skipped, so a failed or interrupted run can simply be run again.
+- Errors are not swallowed: each step is recorded as a `StepStatus` (name, status, detail, seconds) and
+  the whole run is returned as a `ProvisionResult`. Steps that depend on a failed step are `skipped`.
+
+The boto3 clients are passed in, so the whole flow can be run against moto (`mock_aws`) end-to-end.
+"""
+
+import concurrent.futures
+import dataclasses
+import json
+import time
+
+from botocore.exceptions import ClientError
+
+from dwh_config import ACCESS_CFG
+
+
+CREATED = "created"
+EXISTS = "exists"
+DELETED = "deleted"
+ABSENT = "absent"
+READY = "ready"
+KEPT = "kept"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+DEFAULT_TIMEOUT = 30 * 60
+
+
+class WaitTimeout(Exception):
+    """Raised when `wait_until` gives up."""
+
+
+@dataclasses.dataclass
+class StepStatus:
+    """Outcome of one provisioning step."""
+    name: str
+    status: str
+    detail: str = ""
+    seconds: float = 0.0
+
+
+@dataclasses.dataclass
+class ProvisionResult:
+    """Outcome of a whole provision/teardown run."""
+    steps: list = dataclasses.field(default_factory=list)
+    role_arn: str = None
+    endpoint: str = None
+    vpc_id: str = None
+    node_type: str = None
+    num_nodes: int = None
+
+    @property
+    def ok(self):
+        return all(step.status not in (FAILED, SKIPPED) for step in self.steps)
+
+    def step(self, name):
+        return next(step for step in self.steps if step.name == name)
+
+    def print_summary(self):
+        width = max(len(step.name) for step in self.steps)
+        for step in self.steps:
+            print(f"{step.name:<{width}}  {step.status:<8} {step.seconds:7.1f}s  {step.detail}")
+
+
+# CLIENTS AND CONFIG
+
+def create_clients(params):
+    """Create boto3 clients for IAM, EC2, S3 and Redshift (clients, unlike resources, are thread-safe)."""
+    import boto3
+
+    credentials = dict(
+        region_name=params["AWS_REGION"],
+        aws_access_key_id=params["AWS_KEY"],
+        aws_secret_access_key=params["AWS_SECRET"]
+    )
+    return {
+        "iam": boto3.client('iam', **credentials),
+        "ec2": boto3.client('ec2', **credentials),
+        "s3": boto3.client('s3', **credentials),
+        "redshift": boto3.client('redshift', **credentials),
+    }
+
+
+def redshift_cluster_config(params, role_arn):
+    """Build the `create_cluster` keyword arguments."""
+    config = {
+        # Hardware
+        "ClusterType": params["DWH_CLUSTER_TYPE"],
+        "NodeType": params["DWH_NODE_TYPE"],
+
+        #Identifiers & Credentials
+        "DBName": params["DWH_DB"],
+        "ClusterIdentifier": params["DWH_CLUSTER_IDENTIFIER"],
+        "MasterUsername": params["DWH_DB_USER"],
+        "MasterUserPassword": params["DWH_DB_PASSWORD"],
+        "Port": int(params["DWH_PORT"]),
+
+        #Roles (for s3 access)
+        "IamRoles": [role_arn]
+    }
+
+    if params["DWH_CLUSTER_TYPE"] == 'multi-node':
+        config["NumberOfNodes"] = int(params["DWH_NUM_NODES"])
+
+    return config
+
+
+def access_config(params, endpoint, role_arn):
+    """Render the contents of the Redshift Cluster access config file `dwh_035_access.cfg`."""
+    tiering = "".join(
+        f"{key[len('TIERING_'):]}={value}\n" for key, value in params.items() if key.startswith("TIERING_")
+    )
+    return (
+f"""
+[AWS]
+REGION={params["AWS_REGION"]}
+
+[CLUSTER]
+HOST={endpoint}
+DB_NAME={params["DWH_DB"]}
+DB_USER={params["DWH_DB_USER"]}
+DB_PASSWORD={params["DWH_DB_PASSWORD"]}
+DB_PORT={params["DWH_PORT"]}
+
+[IAM_ROLE]
+ARN={role_arn}
+NAME={params["DWH_IAM_ROLE_NAME"]}
+POLICY={params["DWH_IAM_ROLE_POLICY"]}
+
+[S3]
+LOG_DATA={params["S3_LOG_DATA"]}
+LOG_JSONPATH={params["S3_LOG_JSONPATH"]}
+SONG_DATA={params["S3_SONG_DATA"]}
+""" + (f"\n[TIERING]\n{tiering}" if tiering else ""))
+
+
+# WAITING
+
+def wait_until(check, timeout=DEFAULT_TIMEOUT, initial_delay=5, max_delay=60, factor=2,
+               sleep=time.sleep, clock=time.monotonic, description="condition"):
+    """
+    Call `check()` until it returns something truthy, and return that.
+
+    The delay between calls starts at `initial_delay` and is multiplied by `factor` after every call,
+    up to `max_delay`. Raises `WaitTimeout` once `timeout` seconds have passed.
+    """
+    deadline = clock() + timeout
+    delay = initial_delay
+    while True:
+        result = check()
+        if result:
+            return result
+        remaining = deadline - clock()
+        if remaining <= 0:
+            raise WaitTimeout(f"Gave up waiting for {description} after {timeout} seconds")
+        sleep(min(delay, remaining))
+        delay = min(delay * factor, max_delay)
+
+
+def _error_code(e):
+    return e.response.get("Error", {}).get("Code", "")
+
+
+def describe_cluster(redshift, identifier):
+    """Return the cluster properties, or None if there is no such cluster."""
+    try:
+        return redshift.describe_clusters(ClusterIdentifier=identifier)['Clusters'][0]
+    except ClientError as e:
+        if _error_code(e) == "ClusterNotFound":
+            return None
+        raise
+
+
+# PROVISION STEPS
+
+def ensure_role(iam, params):
+    """Create the IAM role that lets Redshift read S3, unless it exists. Returns (status, role ARN)."""
+    try:
+        iam.create_role(
+            Path='/',
+            RoleName=params["DWH_IAM_ROLE_NAME"],
+            Description="Allows Redshift clusters to call AWS services on your behalf.",
+            AssumeRolePolicyDocument=json.dumps(
+                {
+                    'Statement': [
+                        {
+                            'Action': 'sts:AssumeRole',
+                            'Effect': 'Allow',
+                            'Principal': {'Service': 'redshift.amazonaws.com'}
+                        }
+                    ],
+                    'Version': '2012-10-17'
+                }
+            )
+        )
+        status = CREATED
+    except ClientError as e:
+        if _error_code(e) != "EntityAlreadyExists":
+            raise
+        status = EXISTS
+
+    role_arn = iam.get_role(RoleName=params["DWH_IAM_ROLE_NAME"])['Role']['Arn']
+    return status, role_arn
+
+
+def ensure_role_policy(iam, params):
+    """Attach the S3 read only policy to the role, unless it is attached already."""
+    attached = iam.list_attached_role_policies(RoleName=params["DWH_IAM_ROLE_NAME"])['AttachedPolicies']
+    if any(p['PolicyArn'] == params["DWH_IAM_ROLE_POLICY"] for p in attached):
+        return EXISTS
+    iam.attach_role_policy(RoleName=params["DWH_IAM_ROLE_NAME"], PolicyArn=params["DWH_IAM_ROLE_POLICY"])
+    return CREATED
+
+
+def ensure_cluster(redshift, params, role_arn):
+    """Create the Redshift cluster, unless it exists. Returns (status, cluster properties)."""
+    props = describe_cluster(redshift, params["DWH_CLUSTER_IDENTIFIER"])
+    if props is not None:
+        if props.get("ClusterStatus") == "deleting":
+            raise RuntimeError(f"Cluster {params['DWH_CLUSTER_IDENTIFIER']} is being deleted; try again once it is gone")
+        return EXISTS, props
+    props = redshift.create_cluster(**redshift_cluster_config(params, role_arn))['Cluster']
+    return CREATED, props
+
+
+def wait_for_cluster_available(redshift, params, timeout=DEFAULT_TIMEOUT, sleep=time.sleep):
+    """Wait (with backoff) until the cluster is available. Returns (READY, cluster properties)."""
+    def available():
+        props = describe_cluster(redshift, params["DWH_CLUSTER_IDENTIFIER"])
+        if props is not None and props.get("ClusterStatus") == "available":
+            return props
+        return None
+
+    props = wait_until(available, timeout=timeout, sleep=sleep,
+                       description=f"cluster {params['DWH_CLUSTER_IDENTIFIER']} to become available")
+    return READY, props
+
+
+def cluster_vpc_id(ec2, props):
+    """The cluster's VPC, or the account default VPC (where clusters without a subnet group live)."""
+    if props.get("VpcId"):
+        return props["VpcId"]
+    vpcs = ec2.describe_vpcs(Filters=[{"Name": "isDefault", "Values": ["true"]}])["Vpcs"]
+    return vpcs[0]["VpcId"] if vpcs else None
+
+
+def ensure_ingress(ec2, params, vpc_id):
+    """Open the cluster port on the VPC default security group, unless it is open already."""
+    groups = ec2.describe_security_groups(Filters=[
+        {"Name": "vpc-id", "Values": [vpc_id]},
+        {"Name": "group-name", "Values": ["default"]},
+    ])["SecurityGroups"]
+    if not groups:
+        raise RuntimeError(f"No default security group in {vpc_id}")
+    try:
+        ec2.authorize_security_group_ingress(
+            GroupId=groups[0]["GroupId"],
+            CidrIp='0.0.0.0/0',
+            IpProtocol='tcp',
+            FromPort=int(params["DWH_PORT"]),
+            ToPort=int(params["DWH_PORT"])
+        )
+    except ClientError as e:
+        if _error_code(e) != "InvalidPermission.Duplicate":
+            raise
+        return EXISTS
+    return CREATED
+
+
+# RUNNING STEPS
+
+def _run_step(result, name, func, *args):
+    """
+    Run one step and record its `StepStatus` on `result`.
+
+    Step functions return a status, or a `(status, value)` pair; a string value doubles as the detail.
+    Returns the value (or the status when there is none), or None when the step raised.
+    """
+    start = time.perf_counter()
+    try:
+        outcome = func(*args)
+    except Exception as e:
+        result.steps.append(StepStatus(name, FAILED, f"{type(e).__name__}: {e}", time.perf_counter() - start))
+        return None
+    status, value = outcome if isinstance(outcome, tuple) else (outcome, None)
+    detail = value if isinstance(value, str) else ""
+    result.steps.append(StepStatus(name, status, detail, time.perf_counter() - start))
+    return status if value is None else value
+
+
+def _skip(result, *names):
+    for name in names:
+        result.steps.append(StepStatus(name, SKIPPED, "depends on a failed step"))
+
+
+def provision(clients, params, access_path=ACCESS_CFG, timeout=DEFAULT_TIMEOUT, sleep=time.sleep):
+    """
+    Provision the IAM role and Redshift cluster, open the cluster port and write `dwh_035_access.cfg`.
+
+    Safe to re-run: existing resources are reused. Returns a `ProvisionResult`.
+    """
+    iam, ec2, redshift = clients["iam"], clients["ec2"], clients["redshift"]
+    result = ProvisionResult()
+
+    role_arn = _run_step(result, "iam_role", ensure_role, iam, params)
+    if role_arn is None:
+        _skip(result, "iam_role_policy", "redshift_cluster", "security_group_ingress", "cluster_available", "access_config")
+        return result
+    result.role_arn = role_arn
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+        # The policy only needs the role to exist; the cluster only needs its ARN.
+        policy = pool.submit(_run_step, result, "iam_role_policy", ensure_role_policy, iam, params)
+        props = _run_step(result, "redshift_cluster", ensure_cluster, redshift, params, role_arn)
+        if props is None:
+            policy.result()
+            _skip(result, "security_group_ingress", "cluster_available", "access_config")
+            return result
+
+        # The VPC is known as soon as the cluster is created: open the port while we wait.
+        vpc_id = cluster_vpc_id(ec2, props)
+        result.vpc_id = vpc_id
+        ingress = pool.submit(_run_step, result, "security_group_ingress", ensure_ingress, ec2, params, vpc_id)
+        props = _run_step(result, "cluster_available", wait_for_cluster_available, redshift, params, timeout, sleep)
+        policy.result()
+        ingress.result()
+
+    if props is None:
+        _skip(result, "access_config")
+        return result
+
+    result.endpoint = props['Endpoint']['Address']
+    # what AWS actually created, which is what timings should be recorded against
+    result.node_type = props.get('NodeType')
+    result.num_nodes = props.get('NumberOfNodes')
+
+    def write_access_config():
+        with open(access_path, 'w') as f:
+            f.write(access_config(params, result.endpoint, role_arn))
+        return CREATED, access_path
+
+    _run_step(result, "access_config", write_access_config)
+    return result
+
+
+# TEARDOWN STEPS
+
+def delete_cluster(redshift, params):
+    """Delete the cluster (no final snapshot), unless it is already gone or going."""
+    props = describe_cluster(redshift, params["DWH_CLUSTER_IDENTIFIER"])
+    if props is None:
+        return ABSENT
+    if props.get("ClusterStatus") == "deleting":
+        return EXISTS, "already deleting"
+    redshift.delete_cluster(ClusterIdentifier=params["DWH_CLUSTER_IDENTIFIER"], SkipFinalClusterSnapshot=True)
+    return DELETED
+
+
+def wait_for_cluster_deleted(redshift, params, timeout=DEFAULT_TIMEOUT, sleep=time.sleep):
+    """Wait (with backoff) until the cluster no longer exists."""
+    wait_until(lambda: describe_cluster(redshift, params["DWH_CLUSTER_IDENTIFIER"]) is None,
+               timeout=timeout, sleep=sleep,
+               description=f"cluster {params['DWH_CLUSTER_IDENTIFIER']} to be deleted")
+    return DELETED
+
+
+def delete_role(iam, params):
+    """Detach the S3 read only policy and delete the IAM role, unless it is already gone."""
+    try:
+        attached = iam.list_attached_role_policies(RoleName=params["DWH_IAM_ROLE_NAME"])['AttachedPolicies']
+    except ClientError as e:
+        if _error_code(e) == "NoSuchEntity":
+            return ABSENT
+        raise
+    for policy in attached:
+        iam.detach_role_policy(RoleName=params["DWH_IAM_ROLE_NAME"], PolicyArn=policy['PolicyArn'])
+    iam.delete_role(RoleName=params["DWH_IAM_ROLE_NAME"])
+    return DELETED
+
+
+def teardown(clients, params, wait=True, timeout=DEFAULT_TIMEOUT, sleep=time.sleep, keep_role=False, keep_cluster=False):
+    """
+    Delete the Redshift cluster and the IAM role (concurrently). With `wait`, block until the cluster is gone.
+
+    With `keep_role`, only the cluster is deleted (e.g. when the role was there before and is shared);
+    with `keep_cluster`, only the role (e.g. when the cluster was not created by the caller).
+    Safe to re-run: resources that are already gone are reported as `absent`. Returns a `ProvisionResult`.
+    """
+    iam, redshift = clients["iam"], clients["redshift"]
+    result = ProvisionResult()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        if keep_role:
+            role = pool.submit(_run_step, result, "iam_role", lambda: KEPT)
+        else:
+            role = pool.submit(_run_step, result, "iam_role", delete_role, iam, params)
+        if keep_cluster:
+            _run_step(result, "redshift_cluster", lambda: KEPT)
+        else:
+            status = _run_step(result, "redshift_cluster", delete_cluster, redshift, params)
+            if wait:
+                if status is None:
+                    _skip(result, "cluster_deleted")
+                else:
+                    _run_step(result, "cluster_deleted", wait_for_cluster_deleted, redshift, params, timeout, sleep)
+        role.result()
+
+    return result
@@ -0,0 +1,334 @@
+"""
+One command line entry point for the whole Sparkify pipeline.
+
+    python sparkify.py create-cluster
+    python sparkify.py create-tables
+    python sparkify.py etl-stage
+    python sparkify.py etl-star
+    python sparkify.py etl              (etl-stage then etl-star)
+    python sparkify.py tier-songplays   (move old songplays to Parquet, see tiering.py)
+    python sparkify.py delete-cluster
+    python sparkify.py ephemeral-run    (size, create cluster, create tables, etl, delete cluster)
+
+Every subcommand takes:
+
+- `--dry-run`: print the SQL each step would run (or, for the cluster subcommands, the AWS calls it
+  would make) without connecting to anything.
+- `--profile`: time every step and dump its cProfile stats to `<profile-dir>/<step>.prof`
+  (view with `python -m pstats` or snakeviz).
+
+The SQL subcommands also take `--schema` to target another schema. `etl-stage`, `etl-star` and `etl`
+take the load parameters of `sql_templates.LoadParams`: `--log-data`/`--song-data` (with
+`--log-manifest`/`--song-manifest` when those are manifest files) and `--start-time`/`--end-time`
+to load a date range of events. Anything not given comes from `dwh_035_access.cfg`.
+
+`etl-star` and `etl` end by tiering `songplays` (as `tier-songplays` does) when `dwh_035_access.cfg`
+has a `[TIERING]` section or `--archive` is given; `--retain-months` overrides the window.
+
+The SQL subcommands run on Redshift by default. `--backend duckdb` runs the same SQL on a local DuckDB
+database instead (`--duckdb-path`, default `sparkify.duckdb`), reading the `s3://` sources from `--data-dir`
+(see `backends.py`), so the pipeline can be benchmarked and tested without a cluster, e.g.:
+
+    python sparkify.py create-tables --backend duckdb
+    python sparkify.py etl --backend duckdb --data-dir data --profile
+
+The database is a file, so the tables created by one subcommand are there for the next
+(`--duckdb-path :memory:` for a throwaway in-memory database).
+
+`ephemeral-run` takes `--deadline-minutes`, or `--node-type` (one of `ephemeral_run.NODE_TYPES`,
+optionally with `--num-nodes`) to skip the sizing,
+`--input-gb` to skip measuring the S3 input, and `--keep-cluster` (see `ephemeral_run.py`).
+
+The step modules (and boto3/psycopg2) are only imported once a subcommand is picked, so
+`python sparkify.py --help` starts instantly. Only `ephemeral_run.NODE_TYPES` is imported up front,
+for the `--node-type` choices; that module defers boto3 and psycopg2 as well.
+
+The individual scripts (`create_tables.py`, `etl.py`, ...) still work on their own.
+"""
+
+import argparse
+import importlib
+import os
+import time
+
+from ephemeral_run import NODE_TYPES
+
+
+# subcommand -> list of (module, function, argument) steps, each called as
+# function(cur, conn, <argument>=...), where the argument is the target `schema`,
+# the `params` (a sql_templates.LoadParams) of the load, or the `tiering`
+# parameters (a sql_templates.TieringParams; the step is skipped when tiering is off)
+SQL_COMMANDS = {
+    "create-tables": [("create_tables", "drop_tables", "schema"), ("create_tables", "create_tables", "schema")],
+    "etl-stage": [("etl_stage", "load_staging_tables", "params")],
+    "etl-star": [("etl_star", "insert_tables", "params"), ("tiering", "tier_songplays", "tiering")],
+    "etl": [
+        ("etl_stage", "load_staging_tables", "params"),
+        ("etl_star", "insert_tables", "params"),
+        ("tiering", "tier_songplays", "tiering"),
+    ],
+    "tier-songplays": [("tiering", "tier_songplays", "tiering")],
+}
+
+# subcommand -> module whose `main()` does the work and `plan(params)` describes it
+CLUSTER_COMMANDS = {
+    "create-cluster": "create_cluster",
+    "delete-cluster": "delete_cluster",
+}
+
+
+class DryRunCursor:
+    """Stands in for a psycopg2 cursor: prints every statement instead of running it."""
+
+    dry_run = True
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, query, vars=None):
+        self.statements.append(query)
+        print(query.strip())
+        print()
+
+    # queries return nothing, as on an empty database
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class DryRunConnection:
+    """Stands in for a psycopg2 connection during `--dry-run`."""
+
+    def cursor(self):
+        return DryRunCursor()
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def run_step(name, func, args, kwargs=None, profile_dir=None):
+    """Run one step, optionally under cProfile. Returns the elapsed wall-clock seconds."""
+    kwargs = kwargs or {}
+    start = time.perf_counter()
+    if profile_dir:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.runcall(func, *args, **kwargs)
+        path = os.path.join(profile_dir, f"{name}.prof")
+        profiler.dump_stats(path)
+    else:
+        func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def print_timings(timings):
+    """Print the per-step timing summary."""
+    print("*******************************************")
+    print("Step timings")
+    width = max(len(name) for name, _ in timings)
+    for name, seconds in timings:
+        print(f"{name:<{width}}  {seconds:10.2f}s")
+    print(f"{'total':<{width}}  {sum(s for _, s in timings):10.2f}s")
+
+
+def load_params(args):
+    """
+    Build the `LoadParams` for a load from the command line and `dwh_035_access.cfg`.
+
+    On a dry run before the cluster exists (so no `dwh_035_access.cfg` yet), or on a local backend,
+    the S3 sources come from `dwh_020_build.cfg` and the IAM role ARN is left as a placeholder.
+    """
+    from dwh_config import BUILD_CFG, read_config
+    from sql_templates import LoadParams
+
+    overrides = dict(
+        schema=args.schema,
+        log_data=args.log_data,
+        song_data=args.song_data,
+        log_manifest=args.log_manifest or None,
+        song_manifest=args.song_manifest or None,
+        start_time=args.start_time,
+        end_time=args.end_time,
+    )
+    try:
+        return LoadParams.from_config(**overrides)
+    except FileNotFoundError:
+        if not (args.dry_run or args.backend != "redshift"):
+            raise
+
+    config = read_config(BUILD_CFG)
+    params = dict(
+        region=config.get("AWS", "REGION"),
+        iam_role="<IAM role ARN>",
+        log_data=config.get("S3", "LOG_DATA"),
+        log_jsonpath=config.get("S3", "LOG_JSONPATH"),
+        song_data=config.get("S3", "SONG_DATA"),
+    )
+    params.update({k: v for k, v in overrides.items() if v is not None})
+    return LoadParams(**params)
+
+
+def load_tiering(args):
+    """
+    Build the `TieringParams` from the command line and `dwh_035_access.cfg`, or `None` when tiering is off.
+
+    Falls back to `dwh_020_build.cfg` (with a placeholder IAM role ARN) like `load_params`.
+    """
+    from dwh_config import BUILD_CFG
+    from sql_templates import TieringParams
+
+    overrides = dict(schema=args.schema, archive=args.archive, retain_months=args.retain_months)
+    try:
+        return TieringParams.from_config(**overrides)
+    except FileNotFoundError:
+        if not (args.dry_run or args.backend != "redshift"):
+            raise
+    return TieringParams.from_config(BUILD_CFG, iam_role="<IAM role ARN>", **overrides)
+
+
+def run_sql_command(command, args, profile_dir=None):
+    """Run the SQL steps of `command` against Redshift (or print them on a dry run)."""
+    dry_run = args.dry_run
+    step_args = {"schema": args.schema}
+    if any(arg == "params" for _, _, arg in SQL_COMMANDS[command]):
+        step_args["params"] = load_params(args)
+    if any(arg == "tiering" for _, _, arg in SQL_COMMANDS[command]):
+        step_args["tiering"] = load_tiering(args)
+
+    if dry_run:
+        conn = DryRunConnection()
+    elif args.backend == "duckdb":
+        from backends import get_backend
+        conn = get_backend("duckdb", database=args.duckdb_path, data_dir=args.data_dir).connect()
+    else:
+        from backends import get_backend
+        conn = get_backend("redshift").connect()
+    cur = conn.cursor()
+
+    timings = []
+    try:
+        for module_name, func_name, arg in SQL_COMMANDS[command]:
+            if step_args[arg] is None and arg == "tiering":
+                print("Tiering is not set up (no [TIERING] section or --archive): skipped tier_songplays")
+                continue
+            func = getattr(importlib.import_module(module_name), func_name)
+            if dry_run:
+                print(f"-- {module_name}.{func_name}")
+            seconds = run_step(func_name, func, (cur, conn), {arg: step_args[arg]}, profile_dir)
+            timings.append((func_name, seconds))
+    finally:
+        conn.close()
+
+    return timings
+
+
+def run_cluster_command(command, dry_run=False, profile_dir=None):
+    """Run (or on a dry run, describe) a cluster subcommand."""
+    module = importlib.import_module(CLUSTER_COMMANDS[command])
+
+    if dry_run:
+        from dwh_config import load_build_params
+
+        for action in module.plan(load_build_params()):
+            print(action)
+        return []
+
+    name = command.replace("-", "_")
+    return [(name, run_step(name, module.main, (), profile_dir=profile_dir))]
+
+
+def run_ephemeral_command(args, profile_dir=None):
+    """Run (or on a dry run, only size) the ETL on a short-lived cluster."""
+    import ephemeral_run
+
+    kwargs = dict(
+        deadline_minutes=args.deadline_minutes,
+        node_type=args.node_type,
+        num_nodes=args.num_nodes,
+        keep_cluster=args.keep_cluster,
+        dry_run=args.dry_run,
+        gb=args.input_gb,
+    )
+    if args.dry_run:
+        ephemeral_run.main(**kwargs)
+        return []
+    return [("ephemeral_run", run_step("ephemeral_run", ephemeral_run.main, (), kwargs, profile_dir))]
+
+
+def main(argv=None):
+    """Parse the command line and run the chosen subcommand."""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--dry-run", action="store_true", help="print what would run without connecting")
+    common.add_argument("--profile", action="store_true", help="time each step and dump cProfile stats")
+    common.add_argument("--profile-dir", default="profile", help="where to write .prof files (default: profile)")
+
+    parser = argparse.ArgumentParser(prog="sparkify", description="Sparkify Redshift ETL pipeline.")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+    schema = argparse.ArgumentParser(add_help=False)
+    schema.add_argument("--schema", help="target schema (default: search path, normally public)")
+    schema.add_argument("--backend", choices=["redshift", "duckdb"], default="redshift", help="where to run the SQL")
+    schema.add_argument("--duckdb-path", default="sparkify.duckdb", help="DuckDB database file (--backend duckdb)")
+    schema.add_argument("--data-dir", default="data", help="local copy of the S3 bucket (--backend duckdb)")
+
+    load = argparse.ArgumentParser(add_help=False)
+    load.add_argument("--log-data", help="S3 prefix (or manifest) of the event logs")
+    load.add_argument("--log-manifest", action="store_true", help="--log-data is a manifest file")
+    load.add_argument("--song-data", help="S3 prefix (or manifest) of the song data")
+    load.add_argument("--song-manifest", action="store_true", help="--song-data is a manifest file")
+    load.add_argument("--start-time", help="only load events at or after this date/time")
+    load.add_argument("--end-time", help="only load events before this date/time")
+
+    tiering = argparse.ArgumentParser(add_help=False)
+    tiering.add_argument("--archive", help="S3 prefix to move old songplays to (turns tiering on)")
+    tiering.add_argument("--retain-months", type=int, help="months of songplays kept in the warehouse")
+
+    subparsers.add_parser("create-cluster", parents=[common], help="spin up the Redshift cluster")
+    subparsers.add_parser("create-tables", parents=[common, schema], help="drop and create all tables")
+    subparsers.add_parser("etl-stage", parents=[common, schema, load], help="load the staging tables from S3")
+    subparsers.add_parser("etl-star", parents=[common, schema, load, tiering],
+                          help="load the STAR-schema tables from staging")
+    subparsers.add_parser("etl", parents=[common, schema, load, tiering], help="etl-stage then etl-star")
+    subparsers.add_parser("tier-songplays", parents=[common, schema, tiering],
+                          help="move songplays older than the retention window to Parquet")
+    subparsers.add_parser("delete-cluster", parents=[common], help="delete the Redshift cluster and IAM role")
+    ephemeral = subparsers.add_parser("ephemeral-run", parents=[common],
+                                      help="size and create a cluster, run the ETL on it, then delete it")
+    ephemeral.add_argument("--deadline-minutes", type=float, help="pick the cheapest size finishing within this time")
+    ephemeral.add_argument("--node-type", choices=NODE_TYPES, help="skip sizing and use this node type")
+    ephemeral.add_argument("--num-nodes", type=int, help="number of nodes to use with --node-type")
+    ephemeral.add_argument("--input-gb", type=float, help="input size to size for (default: measured on S3)")
+    ephemeral.add_argument("--keep-cluster", action="store_true", help="do not delete the cluster afterwards")
+    args = parser.parse_args(argv)
+
+    profile_dir = None
+    if args.profile and not args.dry_run:
+        profile_dir = args.profile_dir
+        os.makedirs(profile_dir, exist_ok=True)
+
+    if args.command == "ephemeral-run":
+        if args.num_nodes is not None and not args.node_type:
+            ephemeral.error("--num-nodes needs --node-type")
+        timings = run_ephemeral_command(args, profile_dir=profile_dir)
+    elif args.command in CLUSTER_COMMANDS:
+        timings = run_cluster_command(args.command, dry_run=args.dry_run, profile_dir=profile_dir)
+    else:
+        timings = run_sql_command(args.command, args, profile_dir=profile_dir)
+
+    if args.profile and timings:
+        print_timings(timings)
+        if profile_dir:
+            print(f"cProfile stats written to {profile_dir}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,25 @@
-import configparser
-
-
-# CONFIG
-config = configparser.ConfigParser()
-config.read('dwh_035_access.cfg')
+# SQL templates: table names are placeholders (e.g. `{staging_events}`) that
+# sql_templates.py fills in with the (optionally schema-qualified) table name.
 
 # DROP TABLES
 
-staging_events_table_drop = "DROP TABLE IF EXISTS staging_events;"
-staging_songs_table_drop = "DROP TABLE IF EXISTS staging_songs;"
-songplay_table_drop = "DROP TABLE IF EXISTS songplays;"
-user_table_drop = "DROP TABLE IF EXISTS users;"
-song_table_drop = "DROP TABLE IF EXISTS songs;"
-artist_table_drop = "DROP TABLE IF EXISTS artists;"
-time_table_drop = "DROP TABLE IF EXISTS time;"
+staging_events_table_drop = "DROP TABLE IF EXISTS {staging_events};"
+staging_songs_table_drop = "DROP TABLE IF EXISTS {staging_songs};"
+songplay_table_drop = "DROP TABLE IF EXISTS {songplays};"
+user_table_drop = "DROP TABLE IF EXISTS {users};"
+song_table_drop = "DROP TABLE IF EXISTS {songs};"
+artist_table_drop = "DROP TABLE IF EXISTS {artists};"
+time_table_drop = "DROP TABLE IF EXISTS {time};"
+# `songplays_watermark` is not dropped: it describes the cold tier (tiering.py),
+# which outlives the tables.
 
 # CREATE TABLES
 
+# `event_id` is not in the log files: it is the event fingerprint filled in
+# after COPY (see sql_queries_etl_stage.py).
 staging_events_table_create= (
     """
-    CREATE TABLE IF NOT EXISTS staging_events (
+    CREATE TABLE IF NOT EXISTS {staging_events} (
         artist VARCHAR,
         auth VARCHAR,
         firstName VARCHAR,
@@ -37,14 +37,15 @@ staging_events_table_create= (
         status INT,
         ts TIMESTAMP,
         userAgent VARCHAR,
-        userId BIGINT
+        userId BIGINT,
+        event_id CHAR(32)
     );
     """
 )
 
 staging_songs_table_create = (
     """
-    CREATE TABLE IF NOT EXISTS staging_songs (
+    CREATE TABLE IF NOT EXISTS {staging_songs} (
         num_songs INT,
         artist_id VARCHAR,
         artist_latitude DOUBLE PRECISION,
@@ -61,10 +62,12 @@ staging_songs_table_create = (
 
 songplay_table_create = (
     """
-    CREATE TABLE IF NOT EXISTS songplays (
+    CREATE TABLE IF NOT EXISTS {songplays} (
         songplay_id BIGINT IDENTITY(0,1) PRIMARY KEY,
+        event_id CHAR(32),
         start_time TIMESTAMP,
         user_id BIGINT,
+        user_key BIGINT,
         level VARCHAR,
         song_id VARCHAR,
         artist_id VARCHAR,
@@ -75,21 +78,30 @@ songplay_table_create = (
     """
 )
 
+# Type-2 slowly changing dimension: one row per version of a user.
+# `user_key` identifies the version, `user_id` the user. The open version has
+# `effective_to` set to the far future and `is_current` set to TRUE.
+# `row_hash` is the MD5 of the tracked attributes (see sql_queries_etl_star.py).
 user_table_create = (
     """
-    CREATE TABLE IF NOT EXISTS users (
-        user_id BIGINT PRIMARY KEY,
+    CREATE TABLE IF NOT EXISTS {users} (
+        user_key BIGINT IDENTITY(0,1) PRIMARY KEY,
+        user_id BIGINT NOT NULL,
         first_name VARCHAR,
         last_name VARCHAR,
         gender VARCHAR,
-        level VARCHAR
+        level VARCHAR,
+        effective_from TIMESTAMP NOT NULL,
+        effective_to TIMESTAMP NOT NULL,
+        is_current BOOLEAN NOT NULL,
+        row_hash CHAR(32) NOT NULL
     );
     """
 )
 
 song_table_create = (
     """
-    CREATE TABLE IF NOT EXISTS songs (
+    CREATE TABLE IF NOT EXISTS {songs} (
         song_id VARCHAR PRIMARY KEY,
         title VARCHAR NOT NULL,
         artist_id VARCHAR,
@@ -101,7 +113,7 @@ song_table_create = (
 
 artist_table_create = (
     """
-    CREATE TABLE IF NOT EXISTS artists (
+    CREATE TABLE IF NOT EXISTS {artists} (
         artist_id VARCHAR PRIMARY KEY,
         name VARCHAR NOT NULL,
         location VARCHAR,
@@ -113,7 +125,7 @@ artist_table_create = (
 
 time_table_create = (
     """
-    CREATE TABLE IF NOT EXISTS time (
+    CREATE TABLE IF NOT EXISTS {time} (
         start_time TIMESTAMP PRIMARY KEY,
         hour INT,
         day INT,
@@ -125,9 +137,20 @@ time_table_create = (
     """
 )
 
+# Start of the oldest month still in `songplays`: every play before the latest
+# `archived_before` was moved to the cold tier by tiering.py, so the songplays
+# insert skips those events. Empty until the first move.
+songplays_watermark_create = (
+    """
+    CREATE TABLE IF NOT EXISTS {songplays_watermark} (
+        archived_before TIMESTAMP NOT NULL
+    );
+    """
+)
+
 
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
+create_table_templates = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, songplays_watermark_create]
 
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
+drop_table_templates = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
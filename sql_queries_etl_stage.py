@@ -1,44 +1,131 @@
-import configparser
-
-
-# CONFIG
-config = configparser.ConfigParser()
-config.read('dwh_035_access.cfg')
-
-AWS_REGION = config.get('AWS', 'REGION')
-LOG_DATA = config.get('S3', 'LOG_DATA')
-LOG_JSONPATH = config.get('S3', 'LOG_JSONPATH')
-SONG_DATA = config.get('S3', 'SONG_DATA')
-IAM_ROLE = config.get('IAM_ROLE', 'ARN')
+# SQL templates, rendered by sql_templates.py with explicit parameters:
+#
+# - table names (e.g. `{staging_events}`), optionally schema-qualified
+# - `{log_data}`, `{log_jsonpath}`, `{song_data}`: S3 sources (prefixes or manifest files)
+# - `{log_manifest}`, `{song_manifest}`: `MANIFEST` when the source is a manifest file, else empty
+# - `{iam_role}`, `{region}`
 
 # STAGING TABLES
 
 # Reference: https://knowledge.udacity.com/questions/784957
-staging_events_copy = (f"""
-    COPY staging_events
-    FROM '{LOG_DATA}'
-    CREDENTIALS 'aws_iam_role={IAM_ROLE}'
-    FORMAT AS JSON '{LOG_JSONPATH}'
+# The column list leaves out `event_id`, which is not in the log files.
+staging_events_copy = ("""
+    COPY {staging_events} (
+        artist, auth, firstName, gender, itemInSession, lastName, length,
+        level, location, method, page, registration, sessionId, song, status,
+        ts, userAgent, userId
+    )
+    FROM '{log_data}'
+    {log_manifest}
+    CREDENTIALS 'aws_iam_role={iam_role}'
+    FORMAT AS JSON '{log_jsonpath}'
     TIMEFORMAT AS 'epochmillisecs'
     TRUNCATECOLUMNS EMPTYASNULL BLANKSASNULL
     COMPUPDATE OFF
-    REGION '{AWS_REGION}'
+    REGION '{region}'
     ;
 """
 )
 
 # Reference: https://knowledge.udacity.com/questions/784957
-staging_songs_copy = (f"""
-    COPY staging_songs
-    FROM '{SONG_DATA}'
-    CREDENTIALS 'aws_iam_role={IAM_ROLE}'
+staging_songs_copy = ("""
+    COPY {staging_songs}
+    FROM '{song_data}'
+    {song_manifest}
+    CREDENTIALS 'aws_iam_role={iam_role}'
     COMPUPDATE OFF
-    REGION '{AWS_REGION}'
+    REGION '{region}'
     FORMAT AS JSON 'auto'
     TRUNCATECOLUMNS EMPTYASNULL BLANKSASNULL
     ;
 """)
 
+# EVENT FINGERPRINT
+
+# `staging_events` has no natural key, so overlapping or repeated COPYs of the
+# same log files load the same event more than once. Fingerprint every newly
+# copied event from the columns that identify it in the log...
+staging_events_fingerprint = ("""
+    UPDATE {staging_events}
+    SET event_id = MD5(
+        COALESCE(CAST(sessionId AS VARCHAR), '')     || '|' ||
+        COALESCE(CAST(itemInSession AS VARCHAR), '') || '|' ||
+        COALESCE(CAST(ts AS VARCHAR), '')            || '|' ||
+        COALESCE(CAST(userId AS VARCHAR), '')
+    )
+    WHERE event_id IS NULL
+    ;
+""")
+
+# ...then keep one row per fingerprint in a single set-based pass.
+staging_events_dedup_create = ("""
+    CREATE TEMP TABLE staging_events_dedup AS
+    SELECT
+        artist, auth, firstName, gender, itemInSession, lastName, length,
+        level, location, method, page, registration, sessionId, song, status,
+        ts, userAgent, userId, event_id
+    FROM (
+        SELECT
+            se.*,
+            ROW_NUMBER() OVER (PARTITION BY se.event_id ORDER BY se.event_id) AS row_num
+        FROM {staging_events} se
+    ) numbered
+    WHERE row_num = 1
+    ;
+""")
+
+staging_events_dedup_delete = "DELETE FROM {staging_events};"
+
+staging_events_dedup_insert = "INSERT INTO {staging_events} SELECT * FROM staging_events_dedup;"
+
+staging_events_dedup_drop = "DROP TABLE IF EXISTS staging_events_dedup;"
+
+# Every COPY appends the whole song_data prefix again: keep one row per song_id.
+# Rows without a song_id are dropped (songs skips them anyway): partitioned
+# together, they would collapse into one arbitrary row.
+staging_songs_dedup_create = ("""
+    CREATE TEMP TABLE staging_songs_dedup AS
+    SELECT
+        num_songs, artist_id, artist_latitude, artist_longitude, artist_location,
+        artist_name, song_id, title, duration, year
+    FROM (
+        SELECT
+            ss.*,
+            ROW_NUMBER() OVER (PARTITION BY ss.song_id ORDER BY ss.song_id) AS row_num
+        FROM {staging_songs} ss
+        WHERE ss.song_id IS NOT NULL
+    ) numbered
+    WHERE row_num = 1
+    ;
+""")
+
+staging_songs_dedup_delete = "DELETE FROM {staging_songs};"
+
+staging_songs_dedup_insert = "INSERT INTO {staging_songs} SELECT * FROM staging_songs_dedup;"
+
+staging_songs_dedup_drop = "DROP TABLE IF EXISTS staging_songs_dedup;"
+
 # QUERY LISTS
 
-copy_table_queries = [staging_events_copy, staging_songs_copy]
\ No newline at end of file
+dedup_staging_events_templates = [
+    staging_events_fingerprint,
+    staging_events_dedup_drop,
+    staging_events_dedup_create,
+    staging_events_dedup_delete,
+    staging_events_dedup_insert,
+    staging_events_dedup_drop,
+]
+
+dedup_staging_songs_templates = [
+    staging_songs_dedup_drop,
+    staging_songs_dedup_create,
+    staging_songs_dedup_delete,
+    staging_songs_dedup_insert,
+    staging_songs_dedup_drop,
+]
+
+copy_table_templates = [staging_events_copy, staging_songs_copy]
+
+# Run as one transaction (etl_stage.py commits once, at the end), so the staged
+# rows are never left deleted but not re-inserted.
+dedup_staging_templates = dedup_staging_events_templates + dedup_staging_songs_templates
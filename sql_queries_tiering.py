@@ -0,0 +1,176 @@
+# SQL templates for the songplays hot/cold tiering job (tiering.py), rendered by
+# sql_templates.py with explicit parameters:
+#
+# - table names (e.g. `{songplays}`, `{songplays_watermark}`), optionally schema-qualified
+# - `{songplays_all}`, `{songplays_qualified}`: the union view and the songplays table,
+#   always schema-qualified (a view WITH NO SCHEMA BINDING requires it)
+# - `{external_schema}`, `{catalog_database}`: Spectrum schema and the data catalog database behind it
+# - `{archive}`: S3 prefix of the cold tier, one `year=YYYY/month=M/` folder per partition
+# - `{iam_role}`
+# - per partition: `{year}`, `{month}`, `{start}`, `{end}` (the month's start_time range) and
+#   `{first_songplay_id}` (names the unloaded files); `{end}` is also the new watermark
+
+# Approximate uncompressed bytes of a songplays row: the fixed-width columns
+# (8 + 32 + 8 + 8 + 8 + 4 bytes) plus the length of the VARCHAR columns.
+songplay_row_bytes = (
+    "68 + COALESCE(LEN(level), 0) + COALESCE(LEN(song_id), 0) + COALESCE(LEN(artist_id), 0) + "
+    "COALESCE(LEN(location), 0) + COALESCE(LEN(user_agent), 0)"
+)
+
+songplay_columns = (
+    "songplay_id, event_id, start_time, user_id, user_key, level, song_id, artist_id, "
+    "session_id, location, user_agent"
+)
+
+# COLD TIER (set up once)
+
+# Spectrum DDL cannot run inside a transaction block: tiering.py runs these with autocommit.
+external_schema_create = ("""
+    CREATE EXTERNAL SCHEMA IF NOT EXISTS {external_schema}
+    FROM DATA CATALOG
+    DATABASE '{catalog_database}'
+    IAM_ROLE '{iam_role}'
+    CREATE EXTERNAL DATABASE IF NOT EXISTS
+    ;
+""")
+
+songplays_history_exists = ("""
+    SELECT COUNT(*)
+    FROM svv_tables
+    WHERE table_schema = '{external_schema}' AND table_name = 'songplays_history'
+    ;
+""")
+
+# Same columns as `songplays`, partitioned by the `time.year` / `time.month` of the play.
+songplays_history_create = ("""
+    CREATE EXTERNAL TABLE {external_schema}.songplays_history (
+        songplay_id BIGINT,
+        event_id    VARCHAR(32),
+        start_time  TIMESTAMP,
+        user_id     BIGINT,
+        user_key    BIGINT,
+        level       VARCHAR,
+        song_id     VARCHAR,
+        artist_id   VARCHAR,
+        session_id  INT,
+        location    VARCHAR,
+        user_agent  VARCHAR
+    )
+    PARTITIONED BY (year INT, month INT)
+    STORED AS PARQUET
+    LOCATION '{archive}/'
+    ;
+""")
+
+# Both tiers. Late binding, so songplays can still be dropped and recreated.
+songplays_all_view = ("""
+    CREATE OR REPLACE VIEW {songplays_all} AS
+    SELECT {songplay_columns} FROM {songplays_qualified}
+    UNION ALL
+    SELECT {songplay_columns} FROM {external_schema}.songplays_history
+    WITH NO SCHEMA BINDING
+    ;
+""")
+
+# PICK THE COLD PARTITIONS
+
+songplays_latest = "SELECT MAX(start_time) FROM {songplays};"
+
+songplays_scan_size = "SELECT COUNT(*), COALESCE(SUM({songplay_row_bytes}), 0) FROM {songplays};"
+
+# Every month before the retention window that still has plays in the hot tier
+# (a month already moved only shows up again if plays were loaded into it since).
+# EXTRACT gives the same year/month as the `time` dimension, without the join.
+cold_months = ("""
+    SELECT DISTINCT
+        EXTRACT(YEAR FROM start_time)   AS year,
+        EXTRACT(MONTH FROM start_time)  AS month
+    FROM {songplays}
+    WHERE start_time < '{cutoff}'
+    ORDER BY 1, 2
+    ;
+""")
+
+# MOVE ONE PARTITION
+
+# The songplays insert skips events before the watermark, but plays can still be
+# in both tiers: loaded before the watermark was advanced over their month (e.g. by
+# a load running while a move was interrupted), or re-inserted after `songplays`
+# was recreated. Drop those first; whatever is left is moved as usual.
+songplays_partition_dedup = ("""
+    DELETE FROM {songplays}
+    WHERE
+        start_time >= '{start}' AND start_time < '{end}' AND
+        event_id IN (
+            SELECT event_id
+            FROM {external_schema}.songplays_history
+            WHERE year = {year} AND month = {month}
+        )
+    ;
+""")
+
+songplays_partition_size = ("""
+    SELECT MIN(songplay_id), COUNT(*), COALESCE(SUM({songplay_row_bytes}), 0)
+    FROM {songplays}
+    WHERE start_time >= '{start}' AND start_time < '{end}'
+    ;
+""")
+
+# The files are named after the partition's first songplay_id, so re-running a
+# move that failed half way overwrites its own files instead of duplicating
+# them, while plays loaded late into an archived month get files of their own.
+songplays_partition_unload = ("""
+    UNLOAD ('
+        SELECT {songplay_columns}
+        FROM {songplays}
+        WHERE start_time >= ''{start}'' AND start_time < ''{end}''
+    ')
+    TO '{archive}/year={year}/month={month}/songplays_{first_songplay_id}_'
+    IAM_ROLE '{iam_role}'
+    FORMAT AS PARQUET
+    ALLOWOVERWRITE
+    ;
+""")
+
+songplays_partition_add = ("""
+    ALTER TABLE {external_schema}.songplays_history
+    ADD IF NOT EXISTS PARTITION (year={year}, month={month})
+    LOCATION '{archive}/year={year}/month={month}/'
+    ;
+""")
+
+songplays_partition_delete = ("""
+    DELETE FROM {songplays}
+    WHERE start_time >= '{start}' AND start_time < '{end}'
+    ;
+""")
+
+# Keep the events before `{end}` out of later songplays inserts. The watermark
+# only moves forward: the insert filter reads MAX(archived_before).
+songplays_watermark_advance = ("""
+    INSERT INTO {songplays_watermark} (archived_before)
+    SELECT '{end}'::TIMESTAMP
+    FROM (SELECT MAX(archived_before) AS archived_before FROM {songplays_watermark}) w
+    WHERE w.archived_before IS NULL OR w.archived_before < '{end}'
+    ;
+""")
+
+# QUERY LISTS
+
+# (template name, needs autocommit). The external table is only created when
+# `songplays_history_exists` finds none: Redshift has no IF NOT EXISTS for it.
+tiering_setup_templates = [
+    ("external_schema_create", True),
+    ("songplays_history_create", True),
+    ("songplays_all_view", False),
+]
+
+# Unload and register the partition before deleting it from songplays, so an
+# interrupted move leaves the plays in both tiers (fixed by the re-run), never in neither.
+# The delete and the watermark advance are committed together.
+partition_move_templates = [
+    ("songplays_partition_unload", False),
+    ("songplays_partition_add", True),
+    ("songplays_partition_delete", False),
+    ("songplays_watermark_advance", False),
+]
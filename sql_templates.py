@@ -0,0 +1,264 @@
+"""
+Render the Sparkify SQL on demand, with explicit parameters.
+
+The `sql_queries_*.py` modules only hold templates: nothing is read from `dwh_035_access.cfg` there,
+so they can be imported anywhere. This module fills them in for one set of parameters
+(`LoadParams`): where to load from, which schema to load into and which date range of events to
+load. Nothing is read from disk at import time, so one process can render SQL for many sources,
+schemas or date windows side by side, e.g. to drive several loads concurrently, each on its own
+connection. `TieringParams` does the same for the songplays hot/cold tiering job (`tiering.py`).
+
+Rendered statements are cached per parameter set (the parameter classes are frozen and hashable),
+and are returned as tuples so the cached lists cannot be changed by a caller. Each cache keeps the
+`CACHE_SIZE` most recently used entries, so a long-lived process rendering many date windows or
+tiering partitions does not hold on to every statement it ever rendered.
+
+Example:
+
+    params = LoadParams.from_config(schema="nov_2018", start_time="2018-11-01", end_time="2018-12-01")
+    for query in copy_table_queries(params):
+        cur.execute(query)
+"""
+
+import dataclasses
+import datetime
+import functools
+import re
+
+import sql_queries_create_tables
+import sql_queries_etl_stage
+import sql_queries_etl_star
+import sql_queries_tiering
+from dwh_config import ACCESS_CFG, read_config
+
+
+CACHE_SIZE = 128
+
+TABLES = ["staging_events", "staging_songs", "songplays", "users", "songs", "artists", "time", "songplays_watermark"]
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+@dataclasses.dataclass(frozen=True)
+class LoadParams:
+    """
+    Everything the staging and STAR-schema SQL depends on.
+
+    - `log_data`, `song_data`: S3 prefix to load from, or a manifest file when `log_manifest` /
+      `song_manifest` is set.
+    - `schema`: schema holding the tables; `None` means the search path (normally `public`).
+    - `start_time`, `end_time`: optional ISO dates/timestamps. Only staged events with
+      `start_time <= ts < end_time` are loaded into `songplays`, `users` and `time`.
+    """
+
+    region: str
+    iam_role: str
+    log_data: str
+    log_jsonpath: str
+    song_data: str
+    log_manifest: bool = False
+    song_manifest: bool = False
+    schema: str = None
+    start_time: str = None
+    end_time: str = None
+
+    def __post_init__(self):
+        if self.schema is not None and not _IDENTIFIER.match(self.schema):
+            raise ValueError(f"Invalid schema name: {self.schema!r}")
+        for name in ("start_time", "end_time"):
+            value = getattr(self, name)
+            if value is not None:
+                # normalise, so "2018-11-01" and "2018-11-01 00:00:00" share a cache entry
+                object.__setattr__(self, name, datetime.datetime.fromisoformat(str(value)).isoformat(sep=" "))
+
+    @classmethod
+    def from_config(cls, path=ACCESS_CFG, **overrides):
+        """Build the parameters from `dwh_035_access.cfg`, with any field overridden by keyword."""
+        config = read_config(path)
+        params = dict(
+            region=config.get('AWS', 'REGION'),
+            iam_role=config.get('IAM_ROLE', 'ARN'),
+            log_data=config.get('S3', 'LOG_DATA'),
+            log_jsonpath=config.get('S3', 'LOG_JSONPATH'),
+            song_data=config.get('S3', 'SONG_DATA'),
+        )
+        params.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**params)
+
+
+@dataclasses.dataclass(frozen=True)
+class TieringParams:
+    """
+    Everything the songplays hot/cold tiering SQL depends on (see `tiering.py`).
+
+    - `archive`: S3 prefix the cold months of `songplays` are unloaded to, as Parquet.
+    - `retain_months`: calendar months of plays kept in `songplays`, counting the month of the latest play.
+    - `external_schema`, `catalog_database`: Spectrum schema, and the data catalog database behind it,
+      holding the `songplays_history` external table.
+    - `schema`: schema holding `songplays` and the `songplays_all` view; `None` means `public`.
+    """
+
+    iam_role: str
+    archive: str
+    retain_months: int = 12
+    external_schema: str = "spectrum"
+    catalog_database: str = "sparkify"
+    schema: str = None
+
+    def __post_init__(self):
+        for name in ("external_schema", "catalog_database", "schema"):
+            value = getattr(self, name)
+            if value is not None and not _IDENTIFIER.match(value):
+                raise ValueError(f"Invalid {name}: {value!r}")
+        if int(self.retain_months) < 1:
+            raise ValueError(f"retain_months must be at least 1, got {self.retain_months!r}")
+        object.__setattr__(self, "retain_months", int(self.retain_months))
+        object.__setattr__(self, "archive", self.archive.rstrip("/"))
+
+    @classmethod
+    def from_config(cls, path=ACCESS_CFG, **overrides):
+        """
+        Build the parameters from the `[TIERING]` section of `dwh_035_access.cfg`, with any field
+        overridden by keyword. Returns `None` when tiering is not set up (no section, no `archive`).
+        """
+        config = read_config(path)
+        overrides = {k: v for k, v in overrides.items() if v is not None}
+        if not config.has_section('TIERING') and 'archive' not in overrides:
+            return None
+
+        params = {}
+        if config.has_option('IAM_ROLE', 'ARN'):
+            params['iam_role'] = config.get('IAM_ROLE', 'ARN')
+        if config.has_section('TIERING'):
+            section = config['TIERING']
+            for field, option in [("archive", "ARCHIVE"), ("retain_months", "RETAIN_MONTHS"),
+                                  ("external_schema", "EXTERNAL_SCHEMA"), ("catalog_database", "CATALOG_DATABASE")]:
+                if option in section:
+                    params[field] = section[option]
+        params.update(overrides)
+        return cls(**params)
+
+
+def _literal(value):
+    """Escape a value for use inside a single-quoted SQL string literal."""
+    return str(value).replace("'", "''")
+
+
+def table_names(schema=None):
+    """Map each table placeholder to its (optionally schema-qualified) table name."""
+    prefix = f"{schema}." if schema else ""
+    return {table: f"{prefix}{table}" for table in TABLES}
+
+
+def event_window(params):
+    """Render the `{event_window}` conditions for the date range in `params`."""
+    conditions = []
+    if params.start_time is not None:
+        conditions.append(f"AND se.ts >= '{params.start_time}'")
+    if params.end_time is not None:
+        conditions.append(f"AND se.ts < '{params.end_time}'")
+    return " ".join(conditions)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def create_table_queries(schema=None):
+    """CREATE TABLE statements (plus CREATE SCHEMA when `schema` is given)."""
+    if schema is not None and not _IDENTIFIER.match(schema):
+        raise ValueError(f"Invalid schema name: {schema!r}")
+    queries = [q.format(**table_names(schema)) for q in sql_queries_create_tables.create_table_templates]
+    if schema:
+        queries.insert(0, f"CREATE SCHEMA IF NOT EXISTS {schema};")
+    return tuple(queries)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def drop_table_queries(schema=None):
+    """DROP TABLE statements."""
+    if schema is not None and not _IDENTIFIER.match(schema):
+        raise ValueError(f"Invalid schema name: {schema!r}")
+    return tuple(q.format(**table_names(schema)) for q in sql_queries_create_tables.drop_table_templates)
+
+
+def _copy_values(params):
+    return dict(
+        table_names(params.schema),
+        region=_literal(params.region),
+        iam_role=_literal(params.iam_role),
+        log_data=_literal(params.log_data),
+        log_jsonpath=_literal(params.log_jsonpath),
+        song_data=_literal(params.song_data),
+        log_manifest="MANIFEST" if params.log_manifest else "",
+        song_manifest="MANIFEST" if params.song_manifest else "",
+    )
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def copy_table_queries(params):
+    """COPY statements loading the staging tables."""
+    return tuple(q.format(**_copy_values(params)) for q in sql_queries_etl_stage.copy_table_templates)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def dedup_staging_queries(params):
+    """The staged-event fingerprint and staging dedup pass, to run as one transaction after the COPYs."""
+    return tuple(q.format(**table_names(params.schema)) for q in sql_queries_etl_stage.dedup_staging_templates)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def user_table_queries(params):
+    """The type-2 `users` load (backfill, close and insert of versions), to run as one transaction first."""
+    values = dict(table_names(params.schema), event_window=event_window(params))
+    return tuple(q.format(**values) for q in sql_queries_etl_star.user_table_templates)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def insert_table_queries(params):
+    """INSERT statements loading the other STAR-schema tables from the staging tables, after `users`."""
+    values = dict(table_names(params.schema), event_window=event_window(params))
+    return tuple(q.format(**values) for q in sql_queries_etl_star.insert_table_templates)
+
+
+def user_versions_missed_query(params):
+    """Count the staged events whose user attributes differ from the user version recorded at their time."""
+    return sql_queries_etl_star.user_versions_missed.format(**table_names(params.schema), event_window=event_window(params))
+
+
+def tiering_values(params):
+    """The values shared by every `sql_queries_tiering` template, for the parameters in `params`."""
+    schema = params.schema or "public"
+    return dict(
+        table_names(params.schema),
+        songplays_qualified=f"{schema}.songplays",
+        songplays_all=f"{schema}.songplays_all",
+        songplay_columns=sql_queries_tiering.songplay_columns,
+        songplay_row_bytes=sql_queries_tiering.songplay_row_bytes,
+        external_schema=params.external_schema,
+        catalog_database=params.catalog_database,
+        archive=_literal(params.archive),
+        iam_role=_literal(params.iam_role),
+    )
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def tiering_query(params, name, **values):
+    """Render the `sql_queries_tiering` template `name`, with any per-partition `values` (year, month...)."""
+    template = getattr(sql_queries_tiering, name)
+    return template.format(**tiering_values(params), **{k: _literal(v) for k, v in values.items()})
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def tiering_setup_queries(params, create_history=True):
+    """(query, autocommit) pairs setting up the cold tier and the `songplays_all` view over both tiers."""
+    return tuple(
+        (tiering_query(params, name), autocommit)
+        for name, autocommit in sql_queries_tiering.tiering_setup_templates
+        if create_history or name != "songplays_history_create"
+    )
+
+
+def partition_move_queries(params, **partition):
+    """(query, autocommit) pairs moving one month of plays from `songplays` to the cold tier."""
+    return tuple(
+        (tiering_query(params, name, **partition), autocommit)
+        for name, autocommit in sql_queries_tiering.partition_move_templates
+    )
@@ -0,0 +1,135 @@
+"""
+Shared fixtures: a scratch working directory with a copy of the fixture bucket (`tests/data`), and a
+DuckDB connection on it (see `backends.py`), so the pipeline SQL runs without a cluster; and boto3
+clients on moto (`mock_aws`), so provisioning runs without an AWS account.
+
+`tests/data` mirrors the layout of `s3://udacity-dend`: 3 songs, and 3 days of events in which
+user 10 goes from free to paid and user 20 from paid to free.
+"""
+
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURE_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+BUILD_CFG = """
+[AWS]
+REGION=us-west-2
+
+[S3]
+LOG_DATA=s3://udacity-dend/log_data
+LOG_JSONPATH=s3://udacity-dend/log_json_path.json
+SONG_DATA=s3://udacity-dend/song_data
+"""
+
+# The `load_build_params()` dict for a small test cluster.
+BUILD_PARAMS = {
+    "AWS_REGION": "us-west-2",
+    "DWH_CLUSTER_TYPE": "multi-node",
+    "DWH_NUM_NODES": "2",
+    "DWH_NODE_TYPE": "dc2.large",
+    "DWH_CLUSTER_IDENTIFIER": "sparkify-test",
+    "DWH_DB": "sparkify",
+    "DWH_DB_USER": "sparkify",
+    "DWH_DB_PASSWORD": "Passw0rd",
+    "DWH_PORT": "5439",
+    "DWH_IAM_ROLE_NAME": "sparkify-test-role",
+    "DWH_IAM_ROLE_POLICY": "arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess",
+    "S3_LOG_DATA": "s3://udacity-dend/log_data",
+    "S3_LOG_JSONPATH": "s3://udacity-dend/log_json_path.json",
+    "S3_SONG_DATA": "s3://udacity-dend/song_data",
+}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Working directory holding a `dwh_020_build.cfg` and the fixture bucket under `data/`."""
+    shutil.copytree(FIXTURE_DATA, tmp_path / "data")
+    (tmp_path / "dwh_020_build.cfg").write_text(BUILD_CFG)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def duckdb_conn(workdir):
+    """A DuckDB backend connection reading the fixture bucket, with the tables created."""
+    pytest.importorskip("duckdb")
+    from backends import get_backend
+    from create_tables import create_tables
+
+    conn = get_backend("duckdb", database=str(workdir / "sparkify.duckdb"), data_dir="data").connect()
+    create_tables(conn.cursor(), conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def load_params():
+    """Build a `LoadParams` for the fixture bucket, with any field overridden by keyword."""
+    from sql_templates import LoadParams
+
+    def build(**overrides):
+        return LoadParams(
+            region="us-west-2",
+            iam_role="<IAM role ARN>",
+            log_data="s3://udacity-dend/log_data",
+            log_jsonpath="s3://udacity-dend/log_json_path.json",
+            song_data="s3://udacity-dend/song_data",
+            **overrides,
+        )
+
+    return build
+
+
+@pytest.fixture
+def aws_clients(monkeypatch):
+    """boto3 IAM, EC2, S3 and Redshift clients (as `provision.create_clients` returns them) on moto."""
+    pytest.importorskip("moto")
+    import boto3
+    from moto import mock_aws
+
+    # the AWS managed policies (AmazonS3ReadOnlyAccess) only exist in moto with this set
+    monkeypatch.setenv("MOTO_IAM_LOAD_MANAGED_POLICIES", "true")
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+    with mock_aws():
+        yield {name: boto3.client(name, region_name=BUILD_PARAMS["AWS_REGION"]) for name in ("iam", "ec2", "s3", "redshift")}
+
+
+def no_sleep(seconds):
+    """Stand-in for `time.sleep`, so waits with backoff do not slow the tests down."""
+
+
+def scalar(cur, query):
+    """The single value `query` returns."""
+    cur.execute(query)
+    return cur.fetchone()[0]
+
+
+class RecordingCursor:
+    """Cursor that runs nothing and logs the start of every statement to `log`; queries return no rows."""
+
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, query, vars=None):
+        self.log.append(" ".join(query.split())[:30])
+
+    def fetchone(self):
+        return None
+
+
+class RecordingConnection:
+    """Connection that logs every `commit` as "COMMIT", interleaved with the `RecordingCursor` statements."""
+
+    def __init__(self):
+        self.log = []
+
+    def commit(self):
+        self.log.append("COMMIT")
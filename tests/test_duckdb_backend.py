@@ -0,0 +1,101 @@
+"""
+The DuckDB backend: the `sparkify.py` command line end-to-end on the fixture bucket, transactions, and the COPY
+translation.
+"""
+
+import json
+
+import pytest
+
+pytest.importorskip("duckdb")
+
+import duckdb
+
+import sparkify
+from conftest import scalar
+from etl_stage import load_staging_tables
+
+EXPECTED_ROWS = {
+    "staging_events": 10,
+    "staging_songs": 3,
+    "songplays": 7,
+    "users": 4,
+    "songs": 3,
+    "artists": 3,
+    "time": 8,
+}
+
+
+def row_counts(path):
+    db = duckdb.connect(str(path), read_only=True)
+    try:
+        return {table: db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in EXPECTED_ROWS}
+    finally:
+        db.close()
+
+
+def test_cli_create_tables_then_etl_twice(workdir):
+    sparkify.main(["create-tables", "--backend", "duckdb"])
+    sparkify.main(["etl", "--backend", "duckdb"])
+    assert row_counts(workdir / "sparkify.duckdb") == EXPECTED_ROWS
+
+    sparkify.main(["etl", "--backend", "duckdb", "--data-dir", "data"])
+    assert row_counts(workdir / "sparkify.duckdb") == EXPECTED_ROWS
+
+
+def test_copy_turns_blanks_into_null(duckdb_conn, load_params):
+    cur = duckdb_conn.cursor()
+    load_staging_tables(cur, duckdb_conn, load_params())
+
+    # the logged out event has userId ""
+    assert scalar(cur, "SELECT COUNT(*) FROM staging_events WHERE userId IS NULL") == 1
+
+
+def test_copy_fails_on_a_value_that_does_not_fit(duckdb_conn, load_params, workdir):
+    song = workdir / "data" / "song_data" / "A" / "A" / "A" / "TRAAAAA128F1.json"
+    record = json.loads(song.read_text())
+    song.write_text(json.dumps(dict(record, duration="two hundred")))
+
+    with pytest.raises(duckdb.ConversionException):
+        load_staging_tables(duckdb_conn.cursor(), duckdb_conn, load_params())
+
+
+def test_statements_run_in_a_transaction_until_commit(duckdb_conn, load_params):
+    cur = duckdb_conn.cursor()
+    load_staging_tables(cur, duckdb_conn, load_params())
+    cur.execute("DELETE FROM staging_events")
+
+    duckdb_conn.rollback()
+    assert scalar(cur, "SELECT COUNT(*) FROM staging_events") == EXPECTED_ROWS["staging_events"]
+
+    cur.execute("DELETE FROM staging_events")
+    duckdb_conn.commit()
+    assert scalar(duckdb_conn.cursor(), "SELECT COUNT(*) FROM staging_events") == 0
+
+
+def test_autocommit_commits_each_statement(duckdb_conn):
+    cur = duckdb_conn.cursor()
+    cur.execute("INSERT INTO staging_songs (song_id) VALUES ('S1')")
+
+    duckdb_conn.autocommit = True
+    cur.execute("INSERT INTO staging_songs (song_id) VALUES ('S2')")
+    duckdb_conn.rollback()
+
+    assert scalar(cur, "SELECT COUNT(*) FROM staging_songs") == 2
+
+
+def test_closed_cursor_leaves_its_transaction_open(duckdb_conn):
+    with duckdb_conn.cursor() as cur:
+        cur.execute("INSERT INTO staging_songs (song_id) VALUES ('S1')")
+    duckdb_conn.commit()
+
+    assert scalar(duckdb_conn.cursor(), "SELECT COUNT(*) FROM staging_songs") == 1
+
+
+@pytest.mark.parametrize("query", [
+    "COPY staging_songs FROM 's3://bucket/song_data' FORMAT AS CSV",
+    "UNLOAD ('SELECT 1') TO 's3://bucket/out/' FORMAT AS CSV",
+])
+def test_untranslatable_statements_are_rejected(duckdb_conn, query):
+    with pytest.raises(ValueError, match="only translates"):
+        duckdb_conn.cursor().execute(query)
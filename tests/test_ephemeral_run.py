@@ -0,0 +1,222 @@
+"""
+`ephemeral_run.py`: the sizing model, and `run_ephemeral` on moto with injected ETL steps and a fake
+`connect`, so no cluster or database is needed.
+"""
+
+import datetime
+import json
+
+import pytest
+
+import ephemeral_run
+from conftest import BUILD_PARAMS, no_sleep
+
+
+class Connection:
+    def __init__(self):
+        self.closed = False
+
+    def cursor(self):
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def run(aws_clients, tmp_path, monkeypatch):
+    """Call `run_ephemeral` on moto with the given steps, in `tmp_path`; returns (report, connection, benchmarks path)."""
+    monkeypatch.chdir(tmp_path)
+    benchmarks_path = str(tmp_path / "benchmarks.json")
+
+    def run(steps, params=BUILD_PARAMS, **kwargs):
+        conn = Connection()
+
+        def connect(access_path):
+            conn.access_path = access_path
+            with open(access_path) as f:
+                conn.access_config = f.read()
+            return conn
+
+        report = ephemeral_run.run_ephemeral(
+            params, aws_clients, gb=2.0, connect=connect, steps=steps,
+            benchmarks_path=benchmarks_path, sleep=no_sleep, **kwargs,
+        )
+        return report, conn, benchmarks_path
+
+    return run
+
+
+def clusters(aws_clients):
+    return {c["ClusterIdentifier"] for c in aws_clients["redshift"].describe_clusters()["Clusters"]}
+
+
+def roles(aws_clients):
+    return {r["RoleName"] for r in aws_clients["iam"].list_roles()["Roles"]}
+
+
+def test_records_timings_against_the_created_cluster(aws_clients, run):
+    ran = []
+    steps = [(name, lambda cur, conn, access_path, name=name: ran.append(name)) for name in ("create_tables", "insert_tables")]
+
+    report, conn, benchmarks_path = run(steps)
+
+    assert report["ok"], report
+    assert ran == ["create_tables", "insert_tables"] and conn.closed
+    assert report["cluster_identifier"].startswith("sparkify-test-")
+    with open(benchmarks_path) as f:
+        records = json.load(f)
+    assert [r["step"] for r in records] == ["provision", "create_tables", "insert_tables"]
+    assert {(r["node_type"], r["num_nodes"], r["gb"]) for r in records} == {("dc2.large", 2, 2.0)}
+    assert len({r["run_id"] for r in records}) == 1
+    assert clusters(aws_clients) == set() and "sparkify-test-role" not in roles(aws_clients)
+
+
+def test_failing_step_still_tears_down(aws_clients, run):
+    def fail(cur, conn, access_path):
+        raise RuntimeError("COPY failed")
+
+    report, conn, benchmarks_path = run([("load_staging_tables", fail), ("insert_tables", None)])
+
+    assert not report["ok"]
+    assert report["error"] == "load_staging_tables: RuntimeError: COPY failed"
+    assert [name for name, _ in report["timings"]] == ["provision"]
+    assert conn.closed
+    assert report["teardown"].ok and report["teardown"].step("redshift_cluster").status == "deleted"
+    assert clusters(aws_clients) == set()
+    with pytest.raises(FileNotFoundError):
+        open(benchmarks_path)
+
+
+def test_leaves_the_build_cluster_and_shared_role_alone(aws_clients, run, tmp_path):
+    import provision
+
+    build_access = tmp_path / "dwh_035_access.cfg"
+    provision.provision(aws_clients, BUILD_PARAMS, access_path=str(build_access), sleep=no_sleep)
+    build_config = build_access.read_text()
+
+    report, _, _ = run([])
+
+    assert report["ok"], report
+    assert report["provision"].step("iam_role").status == provision.EXISTS
+    assert report["teardown"].step("iam_role").status == provision.KEPT
+    assert clusters(aws_clients) == {"sparkify-test"}
+    assert "sparkify-test-role" in roles(aws_clients)
+    assert build_access.read_text() == build_config
+
+
+def test_stops_when_the_cluster_already_exists(aws_clients, run, tmp_path, monkeypatch):
+    import provision
+
+    monkeypatch.setattr(ephemeral_run, "ephemeral_cluster_identifier", lambda base, now: base)
+    provision.provision(aws_clients, BUILD_PARAMS, access_path=str(tmp_path / "build.cfg"), sleep=no_sleep)
+    ran = []
+
+    report, _, _ = run([("create_tables", lambda cur, conn, access_path: ran.append(1))])
+
+    assert not report["ok"]
+    assert report["error"] == "cluster sparkify-test already existed: stopped without using or deleting it"
+    assert ran == [] and report["teardown"] is None
+    assert clusters(aws_clients) == {"sparkify-test"}
+
+
+def test_cluster_identifier_fits_redshift_limits():
+    now = datetime.datetime(2026, 10, 19, 8, 30, 5)
+
+    assert ephemeral_run.ephemeral_cluster_identifier("sparkify", now) == "sparkify-20261019-083005"
+    long_id = ephemeral_run.ephemeral_cluster_identifier("x" * 47 + "-" + "y" * 20, now)
+    assert len(long_id) == 63 and "--" not in long_id
+
+
+def test_cost_bills_the_whole_run():
+    records = [
+        {"run_id": "a", "node_type": "dc2.large", "num_nodes": 1, "step": "provision", "gb": 1.0, "seconds": 600.0},
+        {"run_id": "a", "node_type": "dc2.large", "num_nodes": 1, "step": "insert_tables", "gb": 1.0, "seconds": 1200.0},
+    ]
+
+    options = ephemeral_run.size_options(records, gb=1.0, node_types={"dc2.large": ephemeral_run.NODE_TYPES["dc2.large"]},
+                                         node_counts=[1, 2])
+
+    by_nodes = {o.num_nodes: o for o in options}
+    assert by_nodes[1].total_seconds == 1800.0
+    assert by_nodes[1].cost == pytest.approx(0.5 * 0.25)
+    assert by_nodes[2].total_seconds == 1200.0
+    assert by_nodes[2].cost == pytest.approx(1200 / 3600 * 0.25 * 2)
+
+
+def test_writes_its_own_access_config(aws_clients, run, tmp_path):
+    build_access = tmp_path / "dwh_035_access.cfg"
+    build_access.write_text("[CLUSTER]\nHOST=build-cluster.example.com\n")
+    seen = []
+
+    report, conn, _ = run([("create_tables", lambda cur, conn, access_path: seen.append(access_path))])
+
+    assert report["ok"], report
+    assert conn.access_path == report["access_path"] == f"dwh_035_access.{report['cluster_identifier']}.cfg"
+    assert seen == [report["access_path"]]
+    assert f"HOST={report['provision'].endpoint}" in conn.access_config
+    assert build_access.read_text() == "[CLUSTER]\nHOST=build-cluster.example.com\n"
+    assert not (tmp_path / report["access_path"]).exists()
+
+
+def test_keep_cluster_keeps_its_access_config(aws_clients, run, tmp_path):
+    report, _, _ = run([], keep_cluster=True)
+
+    assert report["ok"] and report["teardown"] is None
+    assert clusters(aws_clients) == {report["cluster_identifier"]}
+    assert (tmp_path / report["access_path"]).exists()
+
+
+def test_failed_cluster_creation_deletes_the_new_role(aws_clients, run, monkeypatch):
+    from botocore.exceptions import ClientError
+
+    def create_cluster(**kwargs):
+        raise ClientError({"Error": {"Code": "ClusterQuotaExceeded", "Message": "quota"}}, "CreateCluster")
+
+    monkeypatch.setattr(aws_clients["redshift"], "create_cluster", create_cluster)
+    ran = []
+
+    report, _, _ = run([("create_tables", lambda cur, conn, access_path: ran.append(1))])
+
+    assert not report["ok"] and ran == []
+    assert report["error"].startswith("provisioning failed (redshift_cluster: ClientError:")
+    assert "already existed" not in report["error"]
+    assert report["teardown"].step("iam_role").status == "deleted"
+    assert report["teardown"].step("redshift_cluster").status == "kept"
+    assert "sparkify-test-role" not in roles(aws_clients)
+
+
+def test_sizing_skips_records_of_unknown_node_types():
+    records = [
+        {"run_id": "a", "node_type": "dc2.large", "num_nodes": 1, "step": "insert_tables", "gb": 1.0, "seconds": 1200.0},
+        {"run_id": "b", "node_type": "ra3.large", "num_nodes": 1, "step": "insert_tables", "gb": 1.0, "seconds": 10.0},
+    ]
+
+    options = ephemeral_run.size_options(records, gb=1.0)
+
+    assert {o.node_type for o in options} == set(ephemeral_run.NODE_TYPES)
+    by_size = {(o.node_type, o.num_nodes): o for o in options}
+    assert by_size["dc2.large", 1].etl_seconds == pytest.approx(1200.0)
+
+
+@pytest.mark.parametrize("node_type, num_nodes, message", [
+    ("ra3.large", None, "Unknown node type 'ra3.large'"),
+    (None, 2, "num_nodes needs node_type"),
+    ("dc2.8xlarge", 1, "dc2.8xlarge needs at least 2 nodes"),
+])
+def test_plan_run_rejects_cluster_sizes_it_cannot_record(node_type, num_nodes, message):
+    with pytest.raises(ValueError, match=message):
+        ephemeral_run.plan_run(BUILD_PARAMS, [], 1.0, node_type=node_type, num_nodes=num_nodes)
+
+
+@pytest.mark.parametrize("argv", [
+    ["ephemeral-run", "--node-type", "ra3.large"],
+    ["ephemeral-run", "--num-nodes", "4"],
+])
+def test_cli_rejects_unknown_node_type_and_num_nodes_alone(argv, monkeypatch):
+    import sparkify
+
+    monkeypatch.setattr(ephemeral_run, "main", lambda **kwargs: pytest.fail("ran with invalid arguments"))
+    with pytest.raises(SystemExit) as exit_info:
+        sparkify.main(argv)
+    assert exit_info.value.code == 2
@@ -0,0 +1,148 @@
+"""
+`export_query.py` against a fake named cursor: like psycopg2's, it has no `description` until the
+first `fetchmany`.
+"""
+
+import csv
+import datetime
+import decimal
+
+import pytest
+
+import export_query
+
+# (name, type_code, display_size, internal_size, precision, scale, null_ok), as psycopg2 describes columns
+DESCRIPTION = (("songplay_id", 20, None, 8, None, None, None), ("level", 1043, None, -1, None, None, None))
+
+
+class NamedCursor:
+    def __init__(self, rows, description=DESCRIPTION):
+        self._rows = list(rows)
+        self._description = description
+        self.description = None
+        self.fetch_sizes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        pass
+
+    def fetchmany(self, size):
+        self.description = self._description
+        self.fetch_sizes.append(size)
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+
+class Connection:
+    def __init__(self, rows=(), description=DESCRIPTION):
+        self.rows = rows
+        self.description = description
+        self.cursors = []
+
+    def cursor(self, name=None):
+        cur = NamedCursor(self.rows, self.description)
+        self.cursors.append(cur)
+        return cur
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_empty_result_writes_csv_header(tmp_path):
+    path = str(tmp_path / "songplays.csv")
+
+    assert export_query.export_query(Connection(), "SELECT", path) == 0
+    with open(path, newline="") as f:
+        assert list(csv.reader(f)) == [["songplay_id", "level"]]
+
+
+def test_empty_result_writes_parquet_schema(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "songplays.parquet")
+
+    assert export_query.export_query(Connection(), "SELECT", path) == 0
+    table = pq.read_table(path)
+    assert table.num_rows == 0
+    assert table.schema.names == ["songplay_id", "level"]
+
+
+def test_parquet_keeps_numeric_precision_and_timestamptz(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    description = (
+        ("duration", 1700, None, 8, 18, 5, None),
+        ("total", 1700, None, -1, None, None, None),
+        ("played_at", 1184, None, 8, None, None, None),
+    )
+    played_at = datetime.datetime(2018, 11, 1, 21, 1, 46, 796000, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    rows = [(decimal.Decimal("218.93179"), decimal.Decimal("12345678901234567890.123"), played_at)]
+    path = str(tmp_path / "songplays.parquet")
+
+    export_query.export_query(Connection(rows, description), "SELECT", path)
+
+    table = pq.read_table(path)
+    assert table.schema.field("duration").type == pa.decimal128(18, 5)
+    assert table.schema.field("total").type == pa.string()
+    assert table.schema.field("played_at").type == pa.timestamp("us", tz="UTC")
+    assert table.to_pylist() == [{
+        "duration": decimal.Decimal("218.93179"),
+        "total": "12345678901234567890.123",
+        "played_at": played_at.astimezone(datetime.timezone.utc),
+    }]
+
+
+def test_export_streams_every_batch(tmp_path):
+    rows = [(i, "free") for i in range(5)]
+    conn = Connection(rows)
+    path = str(tmp_path / "songplays.csv")
+
+    assert export_query.export_query(conn, "SELECT", path, batch_size=2) == 5
+    assert conn.cursors[0].fetch_sizes == [2, 2, 2, 2]
+    with open(path, newline="") as f:
+        assert len(list(csv.reader(f))) == 6
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson", "parquet"])
+def test_benchmark_uses_batch_size_and_format(fmt, monkeypatch):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    written = []
+    monkeypatch.setattr(export_query, "open_writer", _spy(export_query.open_writer, written))
+    conn = Connection([(i, "paid") for i in range(7)])
+
+    results = export_query.benchmark(conn, "SELECT", batch_sizes=[3], fmt=fmt)
+
+    assert [(r["batch_size"], r["rows"]) for r in results] == [(3, 7)]
+    assert conn.cursors[0].fetch_sizes == [3, 3, 3, 3]
+    assert written == [fmt]
+
+
+def test_benchmark_option_honours_batch_size_and_format(monkeypatch):
+    calls = []
+    monkeypatch.setattr(export_query, "connect", Connection)
+    monkeypatch.setattr(export_query, "benchmark", lambda conn, query, **kwargs: calls.append(kwargs))
+    monkeypatch.setattr("sys.argv", ["export_query.py", "SELECT", "--benchmark", "--batch-size", "500",
+                                     "--format", "ndjson"])
+    export_query.main()
+    monkeypatch.setattr("sys.argv", ["export_query.py", "SELECT", "--benchmark"])
+    export_query.main()
+
+    assert calls == [
+        {"batch_sizes": [500], "fmt": "ndjson"},
+        {"batch_sizes": export_query.BENCHMARK_BATCH_SIZES, "fmt": "csv"},
+    ]
+
+
+def _spy(open_writer, formats):
+    def wrapper(path, fmt, compress=False):
+        formats.append(fmt)
+        return open_writer(path, fmt, compress)
+    return wrapper
@@ -0,0 +1,83 @@
+"""
+`provision.py` end-to-end against moto (`mock_aws`): a fresh provision, a re-run that finds
+everything in place, a teardown and a teardown re-run that finds everything gone.
+"""
+
+import pytest
+
+pytest.importorskip("botocore")
+
+from botocore.exceptions import ClientError
+
+import provision
+from conftest import BUILD_PARAMS as PARAMS, no_sleep
+
+
+def statuses(result):
+    return {step.name: step.status for step in result.steps}
+
+
+def test_provision_then_teardown_are_idempotent(aws_clients, tmp_path):
+    access_path = str(tmp_path / "dwh_035_access.cfg")
+
+    fresh = provision.provision(aws_clients, PARAMS, access_path=access_path, sleep=no_sleep)
+    assert fresh.ok, fresh.steps
+    assert statuses(fresh) == {
+        "iam_role": provision.CREATED,
+        "iam_role_policy": provision.CREATED,
+        "redshift_cluster": provision.CREATED,
+        "security_group_ingress": provision.CREATED,
+        "cluster_available": provision.READY,
+        "access_config": provision.CREATED,
+    }
+    with open(access_path) as f:
+        assert f"HOST={fresh.endpoint}" in f.read()
+    assert (fresh.node_type, fresh.num_nodes) == ("dc2.large", 2)
+
+    rerun = provision.provision(aws_clients, PARAMS, access_path=access_path, sleep=no_sleep)
+    assert rerun.ok, rerun.steps
+    for name in ("iam_role", "iam_role_policy", "redshift_cluster", "security_group_ingress"):
+        assert rerun.step(name).status == provision.EXISTS
+    assert rerun.role_arn == fresh.role_arn
+
+    down = provision.teardown(aws_clients, PARAMS, sleep=no_sleep)
+    assert down.ok, down.steps
+    assert statuses(down) == {
+        "iam_role": provision.DELETED,
+        "redshift_cluster": provision.DELETED,
+        "cluster_deleted": provision.DELETED,
+    }
+    assert provision.describe_cluster(aws_clients["redshift"], "sparkify-test") is None
+
+    down_again = provision.teardown(aws_clients, PARAMS, sleep=no_sleep)
+    assert down_again.ok, down_again.steps
+    assert down_again.step("iam_role").status == provision.ABSENT
+    assert down_again.step("redshift_cluster").status == provision.ABSENT
+
+
+def test_failed_step_skips_the_steps_after_it(aws_clients, tmp_path, monkeypatch):
+    def create_cluster(**kwargs):
+        raise ClientError({"Error": {"Code": "ClusterQuotaExceeded", "Message": "quota"}}, "CreateCluster")
+
+    monkeypatch.setattr(aws_clients["redshift"], "create_cluster", create_cluster)
+
+    result = provision.provision(aws_clients, PARAMS, access_path=str(tmp_path / "access.cfg"), sleep=no_sleep)
+
+    assert not result.ok
+    assert result.step("iam_role_policy").status == provision.CREATED
+    assert result.step("redshift_cluster").status == provision.FAILED
+    assert "ClusterQuotaExceeded" in result.step("redshift_cluster").detail
+    for name in ("security_group_ingress", "cluster_available", "access_config"):
+        assert result.step(name).status == provision.SKIPPED
+    assert not (tmp_path / "access.cfg").exists()
+
+
+def test_teardown_can_keep_the_role(aws_clients, tmp_path):
+    provision.provision(aws_clients, PARAMS, access_path=str(tmp_path / "access.cfg"), sleep=no_sleep)
+
+    down = provision.teardown(aws_clients, PARAMS, sleep=no_sleep, keep_role=True)
+
+    assert down.ok, down.steps
+    assert down.step("iam_role").status == provision.KEPT
+    assert down.step("redshift_cluster").status == provision.DELETED
+    aws_clients["iam"].get_role(RoleName=PARAMS["DWH_IAM_ROLE_NAME"])
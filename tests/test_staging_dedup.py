@@ -0,0 +1,54 @@
+from conftest import RecordingConnection, RecordingCursor, scalar
+from etl_stage import load_staging_tables
+from etl_star import insert_tables
+
+
+def test_rerunning_the_etl_loads_each_event_once(duckdb_conn, load_params):
+    cur = duckdb_conn.cursor()
+    for _ in range(3):
+        load_staging_tables(cur, duckdb_conn, load_params())
+        insert_tables(cur, duckdb_conn, load_params())
+
+    assert scalar(cur, "SELECT COUNT(*) FROM staging_events") == 10
+    assert scalar(cur, "SELECT COUNT(*) FROM staging_songs") == 3
+    assert scalar(cur, "SELECT COUNT(*) FROM songplays") == 7
+    assert scalar(cur, "SELECT COUNT(DISTINCT event_id) FROM songplays") == 7
+    assert scalar(cur, "SELECT COUNT(*) FROM songs") == 3
+    assert scalar(cur, "SELECT COUNT(*) FROM artists") == 3
+    assert scalar(cur, "SELECT COUNT(*) FROM time") == 8
+
+
+def test_event_matching_several_songs_is_loaded_once(duckdb_conn, load_params):
+    cur = duckdb_conn.cursor()
+    load_staging_tables(cur, duckdb_conn, load_params())
+    # a second song with the same artist, title and duration as "Song A"
+    cur.execute("""
+        INSERT INTO staging_songs (num_songs, artist_id, artist_name, song_id, title, duration, year)
+        VALUES (1, 'ARAAAAA1187', 'Artist A', 'SOAAAAZ12AB', 'Song A', 200.0, 2001)
+    """)
+    insert_tables(cur, duckdb_conn, load_params())
+
+    assert scalar(cur, "SELECT COUNT(*) FROM songplays") == 7
+    assert scalar(cur, "SELECT COUNT(DISTINCT event_id) FROM songplays") == 7
+
+
+def test_dedup_pass_is_one_transaction(load_params):
+    conn = RecordingConnection()
+    load_staging_tables(RecordingCursor(conn.log), conn, load_params())
+
+    dedup = conn.log[conn.log.index("UPDATE staging_events SET even"):]
+    assert dedup.count("COMMIT") == 1 and dedup[-1] == "COMMIT"
+    assert "DELETE FROM staging_events;" in dedup and "DELETE FROM staging_songs;" in dedup
+
+
+def test_songs_without_song_id_are_not_kept(duckdb_conn, load_params):
+    cur = duckdb_conn.cursor()
+    cur.execute("""
+        INSERT INTO staging_songs (num_songs, artist_id, artist_name, song_id, title, duration, year)
+        VALUES (1, 'ARZZZZZ1187', 'Artist Z', NULL, 'Song Y', 100.0, 2001),
+               (1, 'ARZZZZZ1187', 'Artist Z', NULL, 'Song Z', 120.0, 2002)
+    """)
+    load_staging_tables(cur, duckdb_conn, load_params())
+
+    assert scalar(cur, "SELECT COUNT(*) FROM staging_songs") == 3
+    assert scalar(cur, "SELECT COUNT(*) FROM staging_songs WHERE song_id IS NULL") == 0
@@ -0,0 +1,75 @@
+"""
+`tiering.py` on DuckDB: the fixture events of 2018-11-01 are moved back to October, so with one
+month retained October goes to the cold tier (Parquet under `data/`) and November stays in `songplays`.
+"""
+
+import pytest
+
+import sparkify
+from conftest import scalar
+from etl_stage import load_staging_tables
+from etl_star import insert_tables
+from sql_templates import TieringParams
+from tiering import tier_songplays
+
+
+@pytest.fixture
+def tiering():
+    return TieringParams(iam_role="<IAM role ARN>", archive="s3://sparkify-archive/songplays_history", retain_months=1)
+
+
+@pytest.fixture
+def loaded(duckdb_conn, load_params):
+    """The fixture events loaded, the first day's plays in October; returns the cursor."""
+    cur = duckdb_conn.cursor()
+    load_staging_tables(cur, duckdb_conn, load_params())
+    cur.execute("UPDATE staging_events SET ts = ts - INTERVAL 1 MONTH WHERE ts < '2018-11-02'")
+    insert_tables(cur, duckdb_conn, load_params())
+    return cur
+
+
+def test_archived_plays_are_not_reinserted(duckdb_conn, load_params, loaded, tiering):
+    cur = loaded
+    october = scalar(cur, "SELECT COUNT(*) FROM songplays WHERE start_time < '2018-11-01'")
+    assert october > 0
+
+    report = tier_songplays(cur, duckdb_conn, tiering)
+    assert [(m.year, m.month, m.plays) for m in report.moved] == [(2018, 10, october)]
+    assert report.before_plays - report.after_plays == october
+    assert scalar(cur, "SELECT MAX(archived_before) FROM songplays_watermark").isoformat() == "2018-11-01T00:00:00"
+
+    insert_tables(cur, duckdb_conn, load_params())
+    assert scalar(cur, "SELECT COUNT(*) FROM songplays") == 7 - october
+    assert scalar(cur, "SELECT COUNT(*) FROM songplays_all") == 7
+    assert scalar(cur, "SELECT COUNT(DISTINCT event_id) FROM songplays_all") == 7
+
+    again = tier_songplays(cur, duckdb_conn, tiering)
+    assert again.moved == [] and again.saved_bytes == 0
+
+
+def test_dropping_plays_already_archived_is_not_counted_as_saved(duckdb_conn, load_params, loaded, tiering):
+    cur = loaded
+    tier_songplays(cur, duckdb_conn, tiering)
+    hot = scalar(cur, "SELECT COUNT(*) FROM songplays")
+    # as if songplays had been loaded before the watermark existed
+    cur.execute("DELETE FROM songplays_watermark")
+    insert_tables(cur, duckdb_conn, load_params())
+    assert scalar(cur, "SELECT COUNT(*) FROM songplays") > hot
+
+    report = tier_songplays(cur, duckdb_conn, tiering)
+
+    assert report.moved == []
+    assert report.before_plays == report.after_plays == hot
+    assert report.saved_bytes == 0
+    assert scalar(cur, "SELECT COUNT(*) FROM songplays_all") == 7
+
+
+def test_dry_run_prints_the_move_statements(workdir, capsys):
+    sparkify.main(["tier-songplays", "--dry-run", "--archive", "s3://sparkify-archive/songplays_history"])
+
+    out = capsys.readouterr().out
+    assert "UNLOAD (" in out
+    assert "TO 's3://sparkify-archive/songplays_history/year=<year>/month=<month>/songplays_<first songplay_id>_'" in out
+    assert "ALTER TABLE spectrum.songplays_history" in out
+    assert "DELETE FROM songplays\n    WHERE start_time >= '<month start>'" in out
+    assert "INSERT INTO songplays_watermark" in out
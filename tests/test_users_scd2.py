@@ -0,0 +1,71 @@
+import datetime
+
+from conftest import RecordingConnection, RecordingCursor, scalar
+from etl_stage import load_staging_tables
+from etl_star import insert_tables
+
+
+OPEN = datetime.datetime(9999, 12, 31)
+
+
+def user_versions(cur):
+    cur.execute("SELECT user_id, level, effective_from, effective_to, is_current FROM users ORDER BY user_id, effective_from")
+    return cur.fetchall()
+
+
+def ts(day, seconds):
+    return datetime.datetime(2018, 11, day, 0, 0, seconds)
+
+
+def test_versions_follow_level_changes(duckdb_conn, load_params):
+    cur = duckdb_conn.cursor()
+    load_staging_tables(cur, duckdb_conn, load_params())
+    insert_tables(cur, duckdb_conn, load_params())
+    expected = [
+        (10, "free", ts(1, 1), ts(2, 1), False),
+        (10, "paid", ts(2, 1), OPEN, True),
+        (20, "paid", ts(1, 4), ts(3, 2), False),
+        (20, "free", ts(3, 2), OPEN, True),
+    ]
+    assert user_versions(cur) == expected
+
+    # re-running the load over the same staging data is a no-op
+    insert_tables(cur, duckdb_conn, load_params())
+    assert user_versions(cur) == expected
+
+
+def test_earlier_window_loaded_later_is_backfilled(duckdb_conn, load_params):
+    cur = duckdb_conn.cursor()
+    load_staging_tables(cur, duckdb_conn, load_params())
+    insert_tables(cur, duckdb_conn, load_params(start_time="2018-11-02"))
+    insert_tables(cur, duckdb_conn, load_params(end_time="2018-11-02"))
+
+    assert user_versions(cur) == [
+        (10, "free", ts(1, 1), ts(2, 1), False),
+        (10, "paid", ts(2, 1), OPEN, True),
+        # the backfilled events match user 20's first version, which is extended back to them
+        (20, "paid", ts(1, 4), ts(3, 2), False),
+        (20, "free", ts(3, 2), OPEN, True),
+    ]
+    assert scalar(cur, "SELECT COUNT(*) FROM songplays WHERE user_key IS NULL") == 0
+
+
+def test_change_inside_loaded_range_is_reported(duckdb_conn, load_params, capsys):
+    cur = duckdb_conn.cursor()
+    load_staging_tables(cur, duckdb_conn, load_params())
+    insert_tables(cur, duckdb_conn, load_params(end_time="2018-11-02"))
+    insert_tables(cur, duckdb_conn, load_params(start_time="2018-11-03"))
+    assert "WARNING" not in capsys.readouterr().out
+
+    # user 10 turned paid on the 2nd, between its free (1st) and paid (3rd) versions
+    insert_tables(cur, duckdb_conn, load_params(start_time="2018-11-02", end_time="2018-11-03"))
+    assert "WARNING: 1 staged events" in capsys.readouterr().out
+
+
+def test_users_load_is_one_transaction(load_params):
+    conn = RecordingConnection()
+    insert_tables(RecordingCursor(conn.log), conn, load_params())
+
+    users = conn.log[:conn.log.index("INSERT INTO songplays ( event_")]
+    assert users.count("COMMIT") == 1 and users[-1] == "COMMIT"
+    assert "UPDATE users SET effective_to " in users and users.count("INSERT INTO users ( user_id, f") == 2
@@ -0,0 +1,223 @@
+"""
+Hot/cold tiering of `songplays`: keep the recent months in Redshift, move the older months to Parquet.
+
+`songplays` only ever grows, and every dashboard query scans all of it. This job keeps the last
+`RETAIN_MONTHS` calendar months of plays (counting the month of the latest play) in `songplays`,
+the hot tier, and moves every older month out to the cold tier:
+
+1. Set up (once) a Spectrum external schema and a `songplays_history` external table, partitioned by
+   the `time.year` / `time.month` of the play, over `s3://<ARCHIVE>/year=YYYY/month=M/`.
+2. For every month before the retention window that still has plays in `songplays`, drop the plays
+   that are already in the cold tier. Then UNLOAD the rest to that month's folder as Parquet, register
+   the partition, delete them from `songplays` and advance the `songplays_watermark` past the month.
+3. Print how much data a full scan of `songplays` no longer reads.
+
+Queries over recent plays keep using `songplays`; queries over the whole history use the
+`songplays_all` view, which unions both tiers.
+
+The songplays insert (`etl_star.py`) skips staged events before the watermark, so a load over old
+staged events does not bring archived plays back. This also means an archived month is closed: plays
+for it that arrive late are not loaded.
+
+The job is incremental: a month is only moved while it still has plays in `songplays`, so once the
+retention window has caught up a run only moves the month that just fell out of it. A move
+interrupted half way is completed by the next run.
+
+It runs after every `etl_star.py`/`etl.py` load when `dwh_035_access.cfg` has a `[TIERING]` section
+(copied from `dwh_020_build.cfg` by `create_cluster.py`):
+
+    [TIERING]
+    ARCHIVE=s3://<your-bucket>/sparkify/songplays_history
+    RETAIN_MONTHS=12
+
+or on its own:
+
+    python tiering.py                       (or: python sparkify.py tier-songplays)
+    python sparkify.py etl-star --archive s3://<your-bucket>/sparkify/songplays_history --retain-months 3
+    python sparkify.py tier-songplays --dry-run   (print the statements, for a placeholder month)
+
+The cluster IAM role needs write access to the archive bucket and access to the AWS Glue data catalog,
+on top of the S3 read access `create_cluster.py` gives it.
+"""
+
+import dataclasses
+import datetime
+
+from dwh_config import connect
+from sql_templates import TieringParams, partition_move_queries, tiering_query, tiering_setup_queries
+
+
+@dataclasses.dataclass
+class PartitionMove:
+    """One month of plays moved to the cold tier."""
+    year: int
+    month: int
+    plays: int
+    bytes: int
+
+
+@dataclasses.dataclass
+class TieringReport:
+    """Outcome of one tiering run. Sizes are approximate uncompressed bytes (see `sql_queries_tiering.py`)."""
+    archive: str
+    cutoff: datetime.datetime = None
+    before_plays: int = 0
+    before_bytes: int = 0
+    after_plays: int = 0
+    after_bytes: int = 0
+    moved: list = dataclasses.field(default_factory=list)
+
+    @property
+    def saved_bytes(self):
+        return self.before_bytes - self.after_bytes
+
+    @property
+    def saved_fraction(self):
+        """Share of a full `songplays` scan this run removed."""
+        return self.saved_bytes / self.before_bytes if self.before_bytes else 0.0
+
+    def print_summary(self):
+        """Print the months moved and the scanned data saved."""
+        if self.cutoff is None:
+            print("songplays is empty: nothing to move")
+            return
+        print(f"Keep plays from {self.cutoff:%Y-%m-%d} on in songplays, move older months to {self.archive}")
+        if self.moved:
+            print(f"{'year':>4} {'month':>5} {'plays':>12} {'MB':>10}")
+            for m in self.moved:
+                print(f"{m.year:>4} {m.month:>5} {m.plays:>12,} {m.bytes / 1024 ** 2:>10.2f}")
+        else:
+            print("No new plays older than that in songplays: nothing to move")
+        print(
+            f"Full scan of songplays: {self.before_plays:,} plays (~{self.before_bytes / 1024 ** 2:.2f} MB) before, "
+            f"{self.after_plays:,} plays (~{self.after_bytes / 1024 ** 2:.2f} MB) after: "
+            f"~{self.saved_bytes / 1024 ** 2:.2f} MB ({self.saved_fraction:.1%}) less data scanned"
+        )
+
+
+def month_start(value, months_back=0):
+    """Midnight on the first day of the month `months_back` months before the month of `value`."""
+    index = value.year * 12 + value.month - 1 - months_back
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def retention_cutoff(latest, retain_months):
+    """Start of the oldest month kept in `songplays`, given the latest play."""
+    return month_start(latest, retain_months - 1)
+
+
+def _execute(cur, conn, query, autocommit=False):
+    """Run `query`; Spectrum DDL (`autocommit`) runs outside a transaction block, which Redshift requires."""
+    if not autocommit:
+        cur.execute(query)
+        return
+    conn.commit()
+    previous = getattr(conn, "autocommit", False)
+    conn.autocommit = True
+    try:
+        cur.execute(query)
+    finally:
+        conn.autocommit = previous
+
+
+def _fetch_value(cur):
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _scan_size(cur, params):
+    """(plays, approximate bytes) a full scan of `songplays` reads."""
+    cur.execute(tiering_query(params, "songplays_scan_size"))
+    return tuple(int(v) for v in cur.fetchone())
+
+
+def ensure_cold_tier(cur, conn, params):
+    """Create the external schema and table (unless they exist) and the `songplays_all` view."""
+    cur.execute(tiering_query(params, "songplays_history_exists"))
+    exists = bool(_fetch_value(cur))
+    for query, autocommit in tiering_setup_queries(params, create_history=not exists):
+        _execute(cur, conn, query, autocommit)
+    conn.commit()
+
+
+def print_dry_run_moves(cur, params):
+    """On a dry run nothing can be read back: show the statements moving one (placeholder) month."""
+    partition = dict(year="<year>", month="<month>", start="<month start>", end="<next month start>")
+    print("-- for every month before the retention window with plays in songplays:")
+    cur.execute(tiering_query(params, "songplays_partition_dedup", **partition))
+    cur.execute(tiering_query(params, "songplays_partition_size", **partition))
+    for query, _ in partition_move_queries(params, first_songplay_id="<first songplay_id>", **partition):
+        cur.execute(query)
+    print("-- then, once every month is moved:")
+    cur.execute(tiering_query(params, "songplays_watermark_advance", end="<retention cutoff>"))
+
+
+def tier_songplays(cur, conn, tiering=None):
+    """
+    Move the months of plays older than the retention window from `songplays` to the cold tier.
+
+    `tiering` (a `TieringParams`) defaults to the `[TIERING]` section of `dwh_035_access.cfg`; without
+    one, tiering is off and nothing runs. Returns the `TieringReport`, or `None` when tiering is off.
+    """
+    params = tiering or TieringParams.from_config()
+    if params is None:
+        print("Tiering is not set up (no [TIERING] section in dwh_035_access.cfg): skipped")
+        return None
+
+    ensure_cold_tier(cur, conn, params)
+    report = TieringReport(archive=params.archive)
+
+    if getattr(cur, "dry_run", False):
+        print_dry_run_moves(cur, params)
+        return report
+
+    cur.execute(tiering_query(params, "songplays_latest"))
+    latest = _fetch_value(cur)
+    if latest is None:
+        report.print_summary()
+        return report
+    report.cutoff = retention_cutoff(latest, params.retain_months)
+
+    cur.execute(tiering_query(params, "cold_months", cutoff=report.cutoff))
+    partitions = []
+    for year, month in cur.fetchall():
+        start = datetime.datetime(int(year), int(month), 1)
+        partitions.append(dict(year=int(year), month=int(month), start=start, end=month_start(start, -1)))
+
+    # Plays already in the cold tier are dropped before measuring, so only real moves count as savings.
+    for partition in partitions:
+        cur.execute(tiering_query(params, "songplays_partition_dedup", **partition))
+    conn.commit()
+    report.before_plays, report.before_bytes = _scan_size(cur, params)
+
+    for partition in partitions:
+        cur.execute(tiering_query(params, "songplays_partition_size", **partition))
+        first_songplay_id, plays, nbytes = cur.fetchone()
+        if not plays:
+            continue
+        for query, autocommit in partition_move_queries(params, first_songplay_id=int(first_songplay_id), **partition):
+            _execute(cur, conn, query, autocommit)
+        conn.commit()
+        report.moved.append(PartitionMove(partition["year"], partition["month"], int(plays), int(nbytes)))
+
+    # Every month before the cutoff is in the cold tier now, including those with nothing left to move.
+    cur.execute(tiering_query(params, "songplays_watermark_advance", end=report.cutoff))
+    conn.commit()
+
+    report.after_plays, report.after_bytes = _scan_size(cur, params)
+    report.print_summary()
+    return report
+
+
+def main():
+    """Move the songplays older than the retention window to the cold tier."""
+    conn = connect()
+    cur = conn.cursor()
+
+    tier_songplays(cur, conn)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()